@@ -0,0 +1,94 @@
+"""
+Throughput of the feature backends and overlap engines of the homography
+filter and agreement of their selected frames with SIFT, on real frames and
+synthetic sequences.
+
+    python -m benchmarks.backends
+    python -m benchmarks.backends --src P28_101.tar --no_synthetic
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import benchmarks  # noqa: F401
+from argparser import parse_args as parse_filter_args
+from filter import make_homography_loader
+from lib import calc_graph, graph2chain
+from benchmarks.scale import selection_drift
+from benchmarks.synthetic import render_sequence
+
+EXAMPLE_FRAMES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example_data', 'P28_101'
+)
+
+# (overlap engine, features, matcher, match mode)
+CONFIGS = [
+    ('matches', 'sift', 'flann', 'pair'),
+    ('matches', 'sift', 'flann', 'anchor'),
+    ('matches', 'orb', 'bf', 'pair'),
+    ('matches', 'orb', 'flann', 'anchor'),
+    ('matches', 'akaze', 'bf', 'pair'),
+    ('matches', 'akaze', 'flann', 'anchor'),
+    ('klt', 'sift', 'flann', 'pair'),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, nargs='*', default=[EXAMPLE_FRAMES],
+                        help='frame directories or tars')
+    parser.add_argument('--no_synthetic', action='store_true')
+    parser.add_argument('--num_frames', type=int, default=150,
+                        help='frames of each synthetic sequence')
+    parser.add_argument('--overlap', type=float, default=0.9)
+    return parser.parse_args()
+
+
+def run(src, engine, features, matcher, match_mode, overlap):
+    filter_args = parse_filter_args([
+        '--src', src, '--overlap_engine', engine, '--features', features,
+        '--matcher', matcher, '--match_mode', match_mode,
+    ])
+    homographies = make_homography_loader(filter_args)
+    fpaths = homographies.images.imreader.fpaths
+    t0 = time.perf_counter()
+    graph = calc_graph(homographies, overlap=overlap)[overlap]
+    runtime = time.perf_counter() - t0
+    return graph2chain(graph, 0), len(fpaths) / runtime
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sources = [(os.path.basename(src.rstrip('/')), src) for src in args.src]
+        if not args.no_synthetic:
+            for motion in ['pan', 'rotate', 'zoom', 'handheld']:
+                src = os.path.join(tmp_dir, motion)
+                render_sequence(src, num_frames=args.num_frames, motion=motion, speed=3)
+                sources.append((f'synthetic-{motion}', src))
+
+        rows = []
+        for name, src in sources:
+            reference = None
+            for config in CONFIGS:
+                selected, fps = run(src, *config, args.overlap)
+                if reference is None:
+                    reference = selected
+                common = len(set(selected) & set(reference))
+                jaccard = common / len(set(selected) | set(reference))
+                rows.append((
+                    name, '/'.join(config), fps, len(selected),
+                    jaccard, selection_drift(selected, reference),
+                ))
+
+    print(f'overlap: {args.overlap}, agreement relative to {"/".join(CONFIGS[0])}')
+    print(f'{"source":>20} {"backend":>28} {"fps":>7} {"selected":>8} '
+          f'{"jaccard":>8} {"drift":>6}')
+    for name, config, fps, num_selected, jaccard, drift in rows:
+        print(f'{name:>20} {config:>28} {fps:>7.1f} {num_selected:>8} '
+              f'{jaccard:>8.3f} {drift:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
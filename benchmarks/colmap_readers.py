@@ -0,0 +1,188 @@
+"""
+Load time of COLMAP binary models with the readers of utils/colmap_utils.py
+against the per-record struct readers they replaced (for points3D.bin, the
+dict reader against the columnar one), on synthetic models. The results of
+both are compared.
+
+    python -m benchmarks.colmap_readers
+    python -m benchmarks.colmap_readers --num_images 20000 --num_points 2000000
+"""
+import argparse
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+import benchmarks  # noqa: F401
+from utils.colmap_utils import (
+    CAMERA_MODEL_IDS, Camera, Image, read_cameras_binary, read_images_binary,
+    read_next_bytes, read_points3d_binary, read_points3d_binary_columnar,
+)
+
+
+def write_synthetic_model(path, num_images=2000, points_per_image=1000, num_points=200000,
+                          seed=0):
+    """ cameras.bin, images.bin and points3D.bin with random values in the COLMAP layout. """
+    rng = np.random.default_rng(seed)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'cameras.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', 2))
+        for camera_id, model_id in [(1, 4), (2, 0)]:
+            num_params = CAMERA_MODEL_IDS[model_id].num_params
+            fid.write(struct.pack('<iiQQ', camera_id, model_id, 456, 256))
+            fid.write(rng.random(num_params).astype('<f8').tobytes())
+    with open(os.path.join(path, 'images.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', num_images))
+        for image_id in range(1, num_images + 1):
+            qvec = rng.standard_normal(4)
+            tvec = rng.standard_normal(3)
+            fid.write(struct.pack('<i4d3di', image_id, *qvec, *tvec, 1 + image_id % 2))
+            fid.write(f'frame_{image_id:010d}.jpg'.encode() + b'\x00')
+            # some images without points
+            n = int(rng.integers(0, 2 * points_per_image)) if image_id % 10 else 0
+            fid.write(struct.pack('<Q', n))
+            points = np.empty(n, dtype=[('xy', '<f8', 2), ('point3D_id', '<i8')])
+            points['xy'] = rng.random([n, 2]) * 456
+            points['point3D_id'] = np.where(rng.random(n) < 0.3, rng.integers(0, 10**6, n), -1)
+            fid.write(points.tobytes())
+    with open(os.path.join(path, 'points3D.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', num_points))
+        for point3D_id in rng.permutation(num_points).tolist():
+            track_length = int(rng.integers(2, 12))
+            fid.write(struct.pack('<Q3d3Bd', point3D_id + 1, *rng.standard_normal(3),
+                                  *rng.integers(0, 256, 3).tolist(), float(rng.random())))
+            fid.write(struct.pack('<Q', track_length))
+            track = np.empty([track_length, 2], dtype='<i4')
+            track[:, 0] = rng.integers(1, num_images + 1, track_length)
+            track[:, 1] = rng.integers(0, 1000, track_length)
+            fid.write(track.tobytes())
+
+
+def reference_read_cameras_binary(path_to_model_file):
+    cameras = {}
+    with open(path_to_model_file, "rb") as fid:
+        num_cameras = read_next_bytes(fid, 8, "Q")[0]
+        for _ in range(num_cameras):
+            camera_id, model_id, width, height = read_next_bytes(fid, 24, "iiQQ")
+            num_params = CAMERA_MODEL_IDS[model_id].num_params
+            params = read_next_bytes(fid, 8 * num_params, "d" * num_params)
+            cameras[camera_id] = Camera(id=camera_id,
+                                        model=CAMERA_MODEL_IDS[model_id].model_name,
+                                        width=width, height=height, params=np.array(params))
+    return cameras
+
+
+def reference_read_images_binary(path_to_model_file):
+    images = {}
+    with open(path_to_model_file, "rb") as fid:
+        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
+        for _ in range(num_reg_images):
+            properties = read_next_bytes(fid, 64, "idddddddi")
+            image_name = ""
+            current_char = read_next_bytes(fid, 1, "c")[0]
+            while current_char != b"\x00":
+                image_name += current_char.decode("utf-8")
+                current_char = read_next_bytes(fid, 1, "c")[0]
+            num_points2D = read_next_bytes(fid, 8, "Q")[0]
+            x_y_id_s = read_next_bytes(fid, 24 * num_points2D, "ddq" * num_points2D)
+            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
+                                   tuple(map(float, x_y_id_s[1::3]))])
+            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
+            images[properties[0]] = Image(
+                id=properties[0], qvec=np.array(properties[1:5]),
+                tvec=np.array(properties[5:8]), camera_id=properties[8], name=image_name,
+                xys=xys, point3D_ids=point3D_ids)
+    return images
+
+
+def same_points(points, columns):
+    """ Same values for every point, and the arrays consumers stack. """
+    if len(points) != len(columns) or set(points) != set(columns):
+        return False
+    for k, point in points.items():
+        column = columns[k]
+        if not (np.array_equal(point.xyz, column.xyz) and np.array_equal(point.rgb, column.rgb)
+                and point.error == column.error
+                and np.array_equal(point.image_ids, column.image_ids)
+                and np.array_equal(point.point2D_idxs, column.point2D_idxs)):
+            return False
+    return np.array_equal(np.asarray([v.xyz for v in points.values()]), columns.xyz)
+
+
+def same_records(a, b):
+    """ Same keys and fields, arrays compared by value and shape. """
+    if a.keys() != b.keys():
+        return False
+    for k in a:
+        for x, y in zip(a[k], b[k]):
+            if isinstance(x, np.ndarray):
+                if x.size == 0 and y.size == 0:
+                    continue
+                if x.shape != y.shape or not np.array_equal(x, y):
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_images', type=int, default=2000)
+    parser.add_argument('--points_per_image', type=int, default=1000,
+                        help='mean number of 2D points of an image')
+    parser.add_argument('--num_points', type=int, default=200000,
+                        help='number of 3D points')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_synthetic_model(tmp_dir, args.num_images, args.points_per_image, args.num_points)
+        cameras_path = os.path.join(tmp_dir, 'cameras.bin')
+        images_path = os.path.join(tmp_dir, 'images.bin')
+        size_mb = os.path.getsize(images_path) / 2**20
+
+        reference, t_reference = timed(reference_read_cameras_binary, cameras_path)
+        cameras, t = timed(read_cameras_binary, cameras_path)
+        rows.append(('cameras.bin', t_reference, t, same_records(reference, cameras)))
+
+        reference, t_reference = timed(reference_read_images_binary, images_path)
+        images, t = timed(read_images_binary, images_path)
+        rows.append(('images.bin', t_reference, t, same_records(reference, images)))
+
+        columns, t = timed(read_images_binary, images_path, columnar=True)
+        ordered = [reference[k] for k in columns.ids.tolist()]
+        same = (
+            [x.name for x in ordered] == columns.names
+            and np.array_equal(np.stack([x.qvec for x in ordered]), columns.qvecs)
+            and np.array_equal(np.concatenate([x.xys.reshape(-1, 2) for x in ordered]),
+                               columns.xys)
+        )
+        rows.append(('images.bin columnar', t_reference, t, same))
+        del reference, images, columns
+
+        points_path = os.path.join(tmp_dir, 'points3D.bin')
+        points_size_mb = os.path.getsize(points_path) / 2**20
+        points, t_reference = timed(read_points3d_binary, points_path)
+        columns, t = timed(read_points3d_binary_columnar, points_path)
+        rows.append(('points3D.bin', t_reference, t, same_points(points, columns)))
+
+    print(f'{args.num_images} images, {size_mb:.0f} MB images.bin, '
+          f'{args.num_points} points, {points_size_mb:.0f} MB points3D.bin')
+    print(f'{"file":>20} {"reference s":>12} {"numpy s":>9} {"speed-up":>9}  same')
+    for name, t_reference, t, same in rows:
+        print(f'{name:>20} {t_reference:>12.3f} {t:>9.3f} {t_reference / t:>8.1f}x  {same}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the colmap executable, to run reconstruct_sparse.py and
+register_dense.py (and time their scheduling) without COLMAP or a GPU:
+
+    COLMAP=$PWD/benchmarks/colmap_stub.py python reconstruct_sparse.py ...
+
+Each command sleeps for COLMAP_STUB_SECONDS (default 1) and writes the
+outputs the scripts look for. database.db is a text file with the image
+names, feature_extractor takes them from --image_list_path or the JPEGs of
+--image_path; mapper and image_registrator write a model of one camera and
+these images without points, and model_analyzer prints its counts. The
+command named by COLMAP_STUB_FAIL exits with 1.
+"""
+import os
+import struct
+import sys
+import time
+
+# PINHOLE
+CAMERA_MODEL_ID = 1
+
+
+def parse_options(argv):
+    return dict(zip(argv[0::2], argv[1::2]))
+
+
+def write_model(path, names):
+    """ cameras.bin, images.bin and points3D.bin in the COLMAP layout. """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'cameras.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', 1))
+        fid.write(struct.pack('<iiQQ4d', 1, CAMERA_MODEL_ID, 456, 256, 200, 200, 228, 128))
+    with open(os.path.join(path, 'images.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', len(names)))
+        for image_id, name in enumerate(names, 1):
+            fid.write(struct.pack('<i4d3di', image_id, 1, 0, 0, 0, 0, 0, 0, 1))
+            fid.write(name.encode() + b'\x00')
+            fid.write(struct.pack('<Q', 0))
+    with open(os.path.join(path, 'points3D.bin'), 'wb') as fid:
+        fid.write(struct.pack('<Q', 0))
+
+
+def read_names(path):
+    with open(path) as fp:
+        return [x.strip() for x in fp if x.strip()]
+
+
+def main():
+    command, options = sys.argv[1], parse_options(sys.argv[2:])
+    time.sleep(float(os.environ.get('COLMAP_STUB_SECONDS', 1)))
+    if os.environ.get('COLMAP_STUB_FAIL') == command:
+        return 1
+    if command == 'feature_extractor':
+        if '--image_list_path' in options:
+            names = read_names(options['--image_list_path'])
+        else:
+            names = sorted(x for x in os.listdir(options['--image_path']) if x.endswith('.jpg'))
+        with open(options['--database_path'], 'w') as fp:
+            fp.writelines(x + '\n' for x in names)
+    elif command == 'mapper':
+        names = read_names(options['--database_path'])
+        write_model(os.path.join(options['--output_path'], '0'), names)
+    elif command == 'image_registrator':
+        write_model(options['--output_path'], read_names(options['--database_path']))
+    elif command == 'model_analyzer':
+        counts = []
+        for name in ['cameras', 'images', 'points3D']:
+            with open(os.path.join(options['--path'], name + '.bin'), 'rb') as fid:
+                counts.append(struct.unpack('<Q', fid.read(8))[0])
+        print('Cameras: %d\nImages: %d\nPoints: %d' % tuple(counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Throughput of the homography filter on synthetic sequences, with the time
+split into decoding, feature extraction, matching and RANSAC, the peak
+memory and the selected frames compared with a stored golden list. Needs
+no dataset, GPU or network.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --cases pan handheld -- --match_mode anchor
+    python -m benchmarks.run --update_golden
+
+Arguments after -- are passed to the filter (see homography_filter/
+argparser.py). Each case runs in a fresh process so that the peak RSS is
+its own. Stage times are the timers of lib.Stats and add up the time of
+all threads, the shares are of their sum ("stages s"), next to the wall
+time of the run ("wall s"). Without --num_workers the difference of the
+two is the time outside the timed stages; with it, the stages of the
+read-ahead threads overlap and "stages s" can exceed "wall s".
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import benchmarks  # noqa: F401
+from benchmarks.scale import selection_drift
+from benchmarks.synthetic import render_sequence
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden.json')
+
+# name: arguments of render_sequence
+CASES = {
+    'pan': dict(motion='pan', speed=2),
+    'rotate': dict(motion='rotate', speed=2),
+    'zoom': dict(motion='zoom', speed=2),
+    'handheld': dict(motion='handheld', speed=2),
+}
+
+STAGES = ['decode', 'features', 'match', 'ransac', 'corners', 'track', 'prescreen']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=str, nargs='+', default=list(CASES),
+                        choices=list(CASES))
+    parser.add_argument('--num_frames', type=int, default=150)
+    parser.add_argument('--overlap', type=float, default=0.9)
+    parser.add_argument('--golden', type=str, default=GOLDEN_PATH)
+    parser.add_argument('--update_golden', action='store_true',
+                        help='store the selected frames as the golden lists')
+    parser.add_argument('filter_args', nargs=argparse.REMAINDER,
+                        help='-- followed by arguments of the filter')
+    args = parser.parse_args()
+    if args.filter_args[:1] == ['--']:
+        args.filter_args = args.filter_args[1:]
+    return args
+
+
+def run_case(src, filter_argv):
+    """ Runs in its own process, returns the stats of one case. """
+    import lib
+    from argparser import parse_args as parse_filter_args
+    from filter import make_homography_loader
+
+    filter_args = parse_filter_args(['--src', src, '--stats'] + filter_argv)
+    homographies = make_homography_loader(filter_args)
+    num_frames = len(homographies.images.imreader.fpaths)
+    t0 = time.perf_counter()
+    graph = lib.calc_graph(homographies, **vars(filter_args))
+    runtime = time.perf_counter() - t0
+    homographies.close()
+    (graph,) = graph.values()
+    timers = homographies.images.stats.summary()['timers']
+    return {
+        'num_frames': num_frames,
+        'runtime': runtime,
+        'times': {stage: x['seconds'] for stage, x in timers.items()},
+        # kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'selected': lib.graph2chain(graph, filter_args.frame_range_min),
+        'num_evaluated': graph['num_evaluated'],
+    }
+
+
+def compare(selected, golden):
+    if golden is None:
+        return 'no golden'
+    if selected == golden:
+        return 'ok'
+    common = len(set(selected) & set(golden))
+    jaccard = common / max(len(set(selected) | set(golden)), 1)
+    return f'DIFF jaccard {jaccard:.3f} drift {selection_drift(selected, golden):.2f}'
+
+
+def main():
+    args = parse_args()
+    filter_argv = ['--overlap', str(args.overlap)] + args.filter_args
+    golden = {}
+    if os.path.isfile(args.golden):
+        with open(args.golden) as fp:
+            golden = json.load(fp)
+
+    # a fresh interpreter per case, forked ones would share the parent's RSS
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.cases:
+            src = os.path.join(tmp_dir, name)
+            render_sequence(src, num_frames=args.num_frames, **CASES[name])
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[name] = executor.submit(run_case, src, filter_argv).result()
+
+    print(f'filter arguments: {" ".join(filter_argv)}')
+    print(f'{"case":>10} {"frames":>6} {"fps":>7} '
+          + ' '.join(f'{stage:>9}' for stage in STAGES)
+          + f' {"stages s":>9} {"wall s":>7} {"rss MB":>7} {"selected":>8}  golden')
+    num_diff = 0
+    for name, result in results.items():
+        params = dict(CASES[name], num_frames=args.num_frames, overlap=args.overlap)
+        entry = golden.get(name)
+        reference = None
+        if entry is not None and entry['params'] == params:
+            reference = entry['selected']
+        status = compare(result['selected'], reference)
+        num_diff += status.startswith('DIFF')
+        runtime = result['runtime']
+        times = [result['times'].get(stage, 0) for stage in STAGES]
+        stage_time = sum(times)
+        shares = [f'{100 * t / max(stage_time, 1e-9):>8.1f}%' for t in times]
+        print(f'{name:>10} {result["num_frames"]:>6} '
+              f'{result["num_frames"] / runtime:>7.1f} {" ".join(shares)} '
+              f'{stage_time:>9.2f} {runtime:>7.2f} '
+              f'{result["peak_rss_mb"]:>7.0f} {len(result["selected"]):>8}  {status}')
+        if args.update_golden:
+            golden[name] = {'params': params, 'selected': result['selected']}
+
+    if args.update_golden:
+        with open(args.golden, 'w') as fp:
+            json.dump(golden, fp, indent=1)
+        print(f'golden lists written to {args.golden}')
+    elif num_diff:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Speed of decoding + SIFT and drift of the selected frames of the
+homography filter for different --filtering_scale values.
+
+    python -m benchmarks.scale --src P28_101.tar --scales 1 2 4 8
+"""
+import argparse
+import time
+
+import benchmarks  # noqa: F401
+from argparser import parse_args as parse_filter_args
+from filter import make_homography_loader
+from lib import calc_graph, graph2chain
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, required=True)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--overlap', type=float, default=0.9)
+    parser.add_argument('--frame_range_min', type=int, default=0)
+    parser.add_argument('--frame_range_max', type=int, default=None)
+    parser.add_argument('--num_timed_frames', type=int, default=100,
+                        help='frames used for timing decode and SIFT')
+    return parser.parse_args()
+
+
+def time_features(homographies, fpaths):
+    images, features = homographies.images, homographies.features
+    t_decode = t_sift = 0
+    for fpath in fpaths:
+        t0 = time.perf_counter()
+        images[fpath]
+        t1 = time.perf_counter()
+        features[fpath]
+        t2 = time.perf_counter()
+        t_decode += t1 - t0
+        t_sift += t2 - t1
+        images.images.pop(fpath)
+        features.features.pop(fpath)
+    return t_decode / len(fpaths), t_sift / len(fpaths)
+
+
+def selection_drift(selected, reference):
+    """ Mean distance (in frames) from a selected frame to the closest
+    reference frame. """
+    if not selected or not reference:
+        return float('nan')
+    return sum(min(abs(s - r) for r in reference) for s in selected) / len(selected)
+
+
+def main():
+    args = parse_args()
+    rows = []
+    reference = None
+    for scale in args.scales:
+        filter_args = parse_filter_args([
+            '--src', args.src, '--filtering_scale', str(scale),
+        ])
+        homographies = make_homography_loader(filter_args)
+        fpaths = homographies.images.imreader.fpaths
+        t_decode, t_sift = time_features(
+            homographies, fpaths[:args.num_timed_frames])
+        graph = calc_graph(
+            homographies,
+            overlap=args.overlap,
+            frame_range_min=args.frame_range_min,
+            frame_range_max=args.frame_range_max,
+        )[args.overlap]
+        selected = graph2chain(graph, args.frame_range_min)
+        if reference is None:
+            reference = selected
+        rows.append((scale, t_decode, t_sift, selected))
+
+    t_ref = rows[0][1] + rows[0][2]
+    print(f'reference scale: {rows[0][0]}, overlap: {args.overlap}')
+    print(f'{"scale":>5} {"decode ms":>10} {"sift ms":>8} {"speedup":>8} '
+          f'{"selected":>8} {"jaccard":>8} {"drift":>6}')
+    for scale, t_decode, t_sift, selected in rows:
+        common = len(set(selected) & set(reference))
+        jaccard = common / len(set(selected) | set(reference))
+        print(f'{scale:>5} {t_decode * 1000:>10.2f} {t_sift * 1000:>8.2f} '
+              f'{t_ref / (t_decode + t_sift):>8.2f} {len(selected):>8} '
+              f'{jaccard:>8.3f} {selection_drift(selected, reference):>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
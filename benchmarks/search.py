@@ -0,0 +1,73 @@
+"""
+Compares the frames selected by the linear and the galloping search of the
+homography filter. Overlap is not strictly monotonic in the frame distance,
+so the two can differ; this reports by how much and what each one costs.
+
+    python -m benchmarks.search --src P28_101.tar --overlap 0.9
+"""
+import argparse
+import time
+
+import benchmarks  # noqa: F401
+from argparser import parse_args as parse_filter_args
+from filter import make_homography_loader
+from lib import calc_graph, graph2chain
+from benchmarks.scale import selection_drift
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, required=True)
+    parser.add_argument('--overlap', type=float, default=0.9)
+    parser.add_argument('--frame_range_min', type=int, default=0)
+    parser.add_argument('--frame_range_max', type=int, default=None)
+    parser.add_argument('--filtering_scale', type=int, default=1)
+    return parser.parse_args()
+
+
+def run(args, search):
+    filter_args = parse_filter_args([
+        '--src', args.src, '--filtering_scale', str(args.filtering_scale),
+    ])
+    homographies = make_homography_loader(filter_args)
+    t0 = time.perf_counter()
+    graph = calc_graph(
+        homographies,
+        overlap=args.overlap,
+        frame_range_min=args.frame_range_min,
+        frame_range_max=args.frame_range_max,
+        search=search,
+    )[args.overlap]
+    runtime = time.perf_counter() - t0
+    selected = graph2chain(graph, args.frame_range_min)
+    return selected, graph['num_evaluated'], runtime
+
+
+def main():
+    args = parse_args()
+    results = {search: run(args, search) for search in ['linear', 'gallop']}
+    linear = results['linear'][0]
+
+    print(f'overlap: {args.overlap}')
+    print(f'{"search":>7} {"selected":>8} {"pairs":>7} {"pairs/sel":>9} '
+          f'{"time s":>8} {"jaccard":>8} {"drift":>6}')
+    for search, (selected, num_evaluated, runtime) in results.items():
+        common = len(set(selected) & set(linear))
+        jaccard = common / len(set(selected) | set(linear))
+        print(f'{search:>7} {len(selected):>8} {num_evaluated:>7} '
+              f'{num_evaluated / max(len(selected) - 1, 1):>9.2f} '
+              f'{runtime:>8.2f} {jaccard:>8.3f} '
+              f'{selection_drift(selected, linear):>6.2f}')
+
+    gallop = results['gallop'][0]
+    only_linear = sorted(set(linear) - set(gallop))
+    only_gallop = sorted(set(gallop) - set(linear))
+    if only_linear or only_gallop:
+        print(f'only linear: {only_linear}')
+        print(f'only gallop: {only_gallop}')
+    else:
+        print('identical selections')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Synthetic frame sequences with known camera motion: a random texture seen
+through a moving camera, each frame a homography warp of the texture.
+"""
+import os
+
+import cv2 as cv
+import numpy as np
+
+import benchmarks  # noqa: F401
+from lib import homography_overlap
+
+
+def make_texture(height, width, seed=0):
+    """ Multi-scale coloured noise with some sharp shapes for corners. """
+    rng = np.random.default_rng(seed)
+    texture = np.zeros([height, width, 3], dtype=np.float32)
+    for sigma in [2, 8, 32]:
+        noise = rng.standard_normal([height, width, 3]).astype(np.float32)
+        texture += cv.GaussianBlur(noise, (0, 0), sigma) * sigma
+    texture -= texture.min()
+    texture = np.uint8(texture * 255 / texture.max())
+    for _ in range(height * width // 2000):
+        color = rng.integers(0, 256, 3).tolist()
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(3, 20))
+        if rng.random() < 0.5:
+            cv.circle(texture, (x, y), r, color, -1)
+        else:
+            cv.rectangle(texture, (x, y), (x + r, y + r), color, -1)
+    return texture
+
+
+def camera_path(num_frames, im_size, motion='pan', speed=1.0, seed=0):
+    """
+    Homographies mapping frame coordinates to texture coordinates, one per
+    frame, with the first frame at the origin.
+
+    motion: 'pan' (translation), 'rotate' (rotation about the image centre
+        with a slow pan), 'zoom' (zooming in and out with a slow pan) or
+        'handheld' (pan with random jitter and still stretches)
+    speed: pan speed in pixels per frame, other motions scale with it
+    """
+    rng = np.random.default_rng(seed)
+    h, w = im_size
+    centre = np.array([[1, 0, w / 2], [0, 1, h / 2], [0, 0, 1]])
+    uncentre = np.linalg.inv(centre)
+    homographies = []
+    position = np.zeros(2)
+    for t in range(num_frames):
+        angle, zoom = 0, 1
+        if motion == 'pan':
+            position = np.array([speed * t, 0.2 * speed * t])
+        elif motion == 'rotate':
+            position = np.array([0.2 * speed * t, 0])
+            angle = 0.002 * speed * t
+        elif motion == 'zoom':
+            position = np.array([0.2 * speed * t, 0])
+            zoom = 1 + 0.3 * np.sin(0.01 * speed * t)
+        elif motion == 'handheld':
+            # still for a few frames now and then
+            if rng.random() > 0.1:
+                position = position + speed * (np.array([1, 0.3]) + rng.normal(0, 0.5, 2))
+            angle = 0.01 * np.sin(0.05 * t)
+        else:
+            raise ValueError(f'Unknown motion: {motion}')
+        c, s = np.cos(angle) / zoom, np.sin(angle) / zoom
+        rotation = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+        translation = np.array([[1, 0, position[0]], [0, 1, position[1]], [0, 0, 1]])
+        homographies.append(translation @ centre @ rotation @ uncentre)
+    return homographies
+
+
+def render_sequence(dst_dir, num_frames=200, im_size=(256, 456), motion='pan',
+                    speed=1.0, seed=0):
+    """
+    Writes frame_%010d.jpg (numbered from 1, as EPIC-KITCHENS frames) to
+    dst_dir and returns the frame-to-texture homographies.
+    """
+    h, w = im_size
+    homographies = camera_path(num_frames, im_size, motion, speed, seed)
+    corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+    warped = np.concatenate(
+        [cv.perspectiveTransform(corners, H) for H in homographies]
+    )[:, 0]
+    lo = np.floor(warped.min(axis=0)) - 1
+    hi = np.ceil(warped.max(axis=0)) + 1
+    texture = make_texture(int(hi[1] - lo[1]), int(hi[0] - lo[0]), seed)
+    offset = np.array([[1, 0, -lo[0]], [0, 1, -lo[1]], [0, 0, 1]])
+
+    os.makedirs(dst_dir, exist_ok=True)
+    for t, H in enumerate(homographies):
+        frame = cv.warpPerspective(
+            texture, offset @ H, (w, h), flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP
+        )
+        cv.imwrite(os.path.join(dst_dir, f'frame_{t + 1:010d}.jpg'), frame)
+    return homographies
+
+
+def true_overlap(homographies, i, j, im_size):
+    """ Overlap of frames i and j as computed by the filter, from the known motion. """
+    M = np.linalg.inv(homographies[j]) @ homographies[i]
+    return homography_overlap(M, im_size)
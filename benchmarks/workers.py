@@ -0,0 +1,99 @@
+"""
+Speed-up of the homography filter with --num_workers against the serial
+run, and the ceiling Amdahl's law puts on it.
+
+With the linear search the workers decode, extract features, match and
+fit the homographies of the pairs following the current one. The calling
+thread only takes the results in order and computes the overlaps, which
+keeps the selection identical. With s the share of the serial runtime
+spent outside the stages run by the workers, n workers on c CPUs speed the
+filter up by at most 1 / max(s, (1 - s) / n, 1 / c) (Amdahl's law). The
+pairs computed past each selected frame are wasted, up to n - 1 per
+selected frame, which the "pairs" column counts against the serial run.
+
+    python -m benchmarks.workers
+    python -m benchmarks.workers --src P28_101.tar --workers 0 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import benchmarks  # noqa: F401
+from benchmarks.synthetic import render_sequence
+
+PARALLEL_STAGES = ['decode', 'features', 'match', 'ransac']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, default=None,
+                        help='frames to filter, by default a synthetic pan')
+    parser.add_argument('--num_frames', type=int, default=150,
+                        help='frames of the synthetic pan')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    parser.add_argument('--overlap', type=float, default=0.9)
+    parser.add_argument('filter_args', nargs=argparse.REMAINDER,
+                        help='-- followed by arguments of the filter')
+    args = parser.parse_args()
+    if args.filter_args[:1] == ['--']:
+        args.filter_args = args.filter_args[1:]
+    return args
+
+
+def run(src, filter_argv):
+    """ Runs in its own process, returns the runtime, stage times and selection. """
+    import lib
+    from argparser import parse_args as parse_filter_args
+    from filter import make_homography_loader
+
+    filter_args = parse_filter_args(['--src', src, '--stats'] + filter_argv)
+    homographies = make_homography_loader(filter_args)
+    t0 = time.perf_counter()
+    (graph,) = lib.calc_graph(homographies, **vars(filter_args)).values()
+    runtime = time.perf_counter() - t0
+    homographies.close()
+    timers = homographies.images.stats.summary()['timers']
+    times = {stage: x['seconds'] for stage, x in timers.items()}
+    num_pairs = timers.get('match', {'count': 0})['count']
+    return runtime, times, num_pairs, lib.graph2chain(graph, filter_args.frame_range_min)
+
+
+def max_speedup(serial_share, num_workers, num_cpus):
+    if num_workers == 0:
+        return 1
+    return 1 / max(serial_share, (1 - serial_share) / num_workers, 1 / num_cpus)
+
+
+def main():
+    args = parse_args()
+    base_argv = ['--overlap', str(args.overlap)] + args.filter_args
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = args.src
+        if src is None:
+            src = os.path.join(tmp_dir, 'pan')
+            render_sequence(src, num_frames=args.num_frames, motion='pan', speed=2)
+        for num_workers in sorted(set(args.workers) | {0}):
+            filter_argv = base_argv + ['--num_workers', str(num_workers)]
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[num_workers] = executor.submit(run, src, filter_argv).result()
+
+    serial_runtime, serial_times, serial_pairs, serial_selected = results[0]
+    parallel = sum(serial_times.get(stage, 0) for stage in PARALLEL_STAGES)
+    serial_share = max(serial_runtime - parallel, 0) / serial_runtime
+    print(f'{os.cpu_count()} CPUs, filter arguments: {" ".join(base_argv)}')
+    print(f'serial share {100 * serial_share:.1f}% (everything but '
+          f'{", ".join(PARALLEL_STAGES)}), speed-up ceiling {1 / max(serial_share, 1e-9):.1f}x')
+    print(f'{"workers":>7} {"time s":>8} {"speed-up":>9} {"bound":>7} {"pairs":>6}  same selection')
+    for num_workers, (runtime, _, num_pairs, selected) in results.items():
+        bound = max_speedup(serial_share, num_workers, os.cpu_count() or 1)
+        print(f'{num_workers:>7} {runtime:>8.2f} {serial_runtime / runtime:>8.2f}x '
+              f'{bound:>6.2f}x {num_pairs / max(serial_pairs, 1):>5.2f}x  '
+              f'{selected == serial_selected}')
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,13 @@ import sys
 import os
 import os.path as osp
 from pathlib import Path
+import shutil
 import subprocess
 import logging
-import pycolmap
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from utils.lib import get_num_images
+from utils.manifest import Manifest
 
 
 def parse_args():
@@ -62,6 +66,9 @@ class PipelineExecutor:
         self.longside = longside
 
         self.frames_dir = self.worker_dir / 'frames'
+        # frames_dir holds the selected frames until all are extracted
+        self.frames_done = self.worker_dir / 'frames.done'
+        self.frames_tmp_dir = self.worker_dir / 'frames.tmp'
         self.homo_path = self.worker_dir / 'homo90.txt'
         self.colmap_dir = self.worker_dir / 'colmap'
         self.pipeline_log = self.worker_dir / 'pipeline.log'
@@ -81,9 +88,14 @@ class PipelineExecutor:
         assert os.path.exists(self.pipeline_log)
 
     def extract_frames(self, with_skip=True):
+        """
+        All frames, only registration needs them. The selected frames
+        already in frames_dir are kept, the sparse model was reconstructed
+        from their pixels.
+        """
         # num_expected_frames = -1
-        if with_skip and os.path.exists(self.frames_dir) and len(os.listdir(self.frames_dir)) > 0:
-            print(f'{self.frames_dir} exist and is non-empty, skip')
+        if with_skip and os.path.exists(self.frames_done):
+            print(f'{self.frames_dir} is complete, skip')
             return
 
         cmd1 = [
@@ -101,21 +113,38 @@ class PipelineExecutor:
 
         s = f'{w}x{h}'
         os.makedirs(self.frames_dir, exist_ok=True)
+        # ffmpeg decodes and scales differently from the filter, it writes
+        # elsewhere and only the frames the filter did not write are moved
+        shutil.rmtree(self.frames_tmp_dir, ignore_errors=True)
+        os.makedirs(self.frames_tmp_dir)
 
         print("Extracting frames... ")
         cmd2 = [
-            'ffmpeg', '-i', self.video_file, '-q:v', '1', '-vf', 'fps=30', '-s', s, f'{self.frames_dir}/frame_%010d.jpg']
+            'ffmpeg', '-i', self.video_file, '-q:v', '1', '-vf', 'fps=30', '-s', s, f'{self.frames_tmp_dir}/frame_%010d.jpg']
         cmd2 = ' '.join(cmd2)
         p = subprocess.call(cmd2, shell=True)
+        if p == 0:
+            for fn in os.listdir(self.frames_tmp_dir):
+                if not os.path.exists(self.frames_dir / fn):
+                    os.replace(self.frames_tmp_dir / fn, self.frames_dir / fn)
+            shutil.rmtree(self.frames_tmp_dir)
+            self.frames_done.touch()
         self.logger.info(f'Extract frames done')
 
     def run_homography(self):
+        """
+        Selects frames from the video directly and writes only the selected
+        ones to frames_dir, named and sized as extract_frames() would.
+        """
         self.logger.info(f'Run homography')
-        cmd = [ 
+        cmd = [
             'python', 'homography_filter/filter.py', '--src',
-            str(self.frames_dir), '--dst_file', str(self.homo_path), '--overlap', '0.9'
-        ] 
+            str(self.video_file), '--dst_file', str(self.homo_path), '--overlap', '0.9',
+            '--dst_frames', str(self.frames_dir), '--video_fps', '30',
+            '--video_longside', str(self.longside),
+        ]
         print(' '.join(cmd))
+        # filter.py writes the list once the selected frames are written
         if os.path.exists(self.homo_path):
             with open(self.homo_path, 'r') as fp:
                 lines = fp.readlines()
@@ -185,7 +214,6 @@ class PipelineExecutor:
         self.logger.info(f'Done Dense PCD')
 
     def execute(self):
-        self.extract_frames()
         self.run_homography()
         if not osp.exists(self.homo_path):
             print(f'{self.homo_path} not exist after homography, abort')
@@ -194,6 +222,7 @@ class PipelineExecutor:
         if not self.get_summary()['num_sparse_models'] > 0:
             print(f"num_sparse_models <= 0 after sparse reconstruction, abort")
             return
+        self.extract_frames()
         self.run_register()
         self.run_dense_pcd()
     
@@ -206,7 +235,10 @@ class PipelineExecutor:
             num_frames=-1, num_homo=-1, num_sparse_models=-1,
             max_sparse_ind=-1, num_sparse_images=-1, num_register=-1
         )
-        info['num_frames'] = len(os.listdir(self.frames_dir))
+        # cached by directory mtime, get_summary runs before every step
+        manifest = Manifest(self.worker_dir, depth=1, videos=[self.frames_dir.name])
+        if self.frames_dir.name in manifest.videos:
+            info['num_frames'] = manifest.num_frames(self.frames_dir.name)
         if not os.path.exists(self.homo_path):
             return info
 
@@ -219,8 +251,7 @@ class PipelineExecutor:
         info['num_sparse_models'] = len(os.listdir(self.sparse_dir))
         for mod in os.listdir(self.sparse_dir):
             mod_path = osp.join(self.sparse_dir, mod)
-            recon = pycolmap.Reconstruction(mod_path)
-            num_images = recon.num_images()
+            num_images = get_num_images(mod_path)
             if num_images > info['num_sparse_images']:
                 info['num_sparse_images'] = num_images
                 info['max_sparse_ind'] = mod  # str
@@ -228,9 +259,7 @@ class PipelineExecutor:
         reg_path = osp.join(self.register_dir)
         if not osp.exists(osp.join(reg_path, 'images.bin')):
             return info
-        recon = pycolmap.Reconstruction(reg_path)
-        num_images = recon.num_images()
-        info['num_register'] = num_images
+        info['num_register'] = get_num_images(reg_path)
         
         return info
 
@@ -2,7 +2,7 @@
 import argparse
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--src",
@@ -12,10 +12,34 @@ def parse_args():
         "--dst_file",
         type=str,
     )
+    parser.add_argument(
+        "--dst_frames",
+        default=None,
+        type=str,
+        help="directory to write the selected frames to as JPEGs, e.g. when "
+        "--src is a video",
+    )
+    parser.add_argument(
+        "--video_fps",
+        default=None,
+        type=float,
+        help="frame rate to resample a video --src to, as ffmpeg -vf fps=..., "
+        "by default every frame of the video is used",
+    )
+    parser.add_argument(
+        "--video_longside",
+        default=None,
+        type=int,
+        help="resize the frames of a video --src to this long side",
+    )
     parser.add_argument(
         "--overlap",
-        default=0.9,
+        default=[0.9],
         type=float,
+        nargs="+",
+        help="select a new frame once its overlap with the previous selected "
+        "frame drops below this value, several values are selected in one pass "
+        "with the linear search and in one pass each with the galloping one",
     )
     parser.add_argument(
         "--frame_range_min",
@@ -31,11 +55,125 @@ def parse_args():
         "--filtering_scale",
         default=1,
         type=int,
+        help="decode frames downscaled by this factor, 2, 4 and 8 are "
+        "reduced while decoding the JPEG",
+    )
+    parser.add_argument(
+        "--search",
+        default="linear",
+        choices=["linear", "gallop"],
+        help="how to find the next frame below --overlap: test every frame "
+        "(linear) or probe exponentially growing steps and bisect (gallop)",
+    )
+    parser.add_argument(
+        "--features",
+        default="sift",
+        choices=["sift", "orb", "akaze"],
+        help="keypoint detector and descriptor, orb and akaze have binary "
+        "descriptors matched with the Hamming distance",
+    )
+    parser.add_argument(
+        "--matcher",
+        default="flann",
+        choices=["flann", "bf"],
+        help="FLANN (KD-tree for sift, LSH for binary descriptors) or brute force",
+    )
+    parser.add_argument(
+        "--match_mode",
+        default="pair",
+        choices=["pair", "anchor"],
+        help="build the FLANN index for every pair of frames (pair) or once "
+        "per anchor frame (anchor)",
+    )
+    parser.add_argument(
+        "--overlap_engine",
+        default="matches",
+        choices=["matches", "klt"],
+        help="fit homographies to matched features (matches) or to corners "
+        "tracked with Lucas-Kanade from the anchor frame (klt), pairs whose "
+        "tracks are lost fall back to matched features",
+    )
+    parser.add_argument(
+        "--prescreen",
+        action="store_true",
+        help="estimate the overlap from the shift between thumbnails first "
+        "and skip the full check of pairs clearly above --overlap",
+    )
+    parser.add_argument(
+        "--prescreen_margin",
+        default=0.05,
+        type=float,
+        help="pairs estimated at least this much above --overlap are not "
+        "checked further",
+    )
+    parser.add_argument(
+        "--num_workers",
+        default=0,
+        type=int,
+        help="threads working ahead of the search, 0 runs everything "
+        "serially. The linear search decodes, extracts features, matches and "
+        "fits the pairs following the current one, as many at a time as there "
+        "are threads, the galloping one computes the features of its next "
+        "probe, and none with --prescreen or --overlap_engine klt (klt decodes "
+        "the following frames ahead instead). The selection does not change, "
+        "see benchmarks/workers.py for the speed-up",
+    )
+    parser.add_argument(
+        "--read_ahead",
+        default=32,
+        type=int,
+        help="max number of frames in flight when --num_workers > 0 with the "
+        "galloping search or --overlap_engine klt",
+    )
+    parser.add_argument(
+        "--num_chunks",
+        default=1,
+        type=int,
+        help="split the frame range into chunks processed in parallel "
+        "processes, the stitched selection equals the serial one. Needs the "
+        "linear search, the galloping probes of a serial run cross the chunk "
+        "ends",
+    )
+    parser.add_argument(
+        "--chunk_overlap",
+        default=300,
+        type=int,
+        help="frames each chunk extends into the next one",
+    )
+    parser.add_argument(
+        "--cache_mb",
+        default=1024,
+        type=int,
+        help="memory for the images, features, matches and homographies "
+        "kept in memory, least recently used ones are evicted",
+    )
+    parser.add_argument(
+        "--feature_cache",
+        default=None,
+        type=str,
+        help="directory to keep the features of every frame in, later runs "
+        "on the same source reuse them",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="write timers and counters of the filter stages to "
+        "<dst_file without extension>.stats.json",
+    )
+    parser.add_argument(
+        "--save_pairs",
+        action="store_true",
+        help="write the frame indices, homography, inliers and overlap of "
+        "every evaluated pair to <dst_file without extension>.pairs.npz, "
+        "see reselect.py",
     )
     parser.add_argument(
         '-f',
         type=str,
         default=None
     )
-    args = parser.parse_args()
+    # names of the frames of a directory --src, set by callers that listed
+    # it already (see select_sparse_frames.filter_video), else it is listed
+    parser.set_defaults(frames=None)
+    args = parser.parse_args(argv)
     return args
@@ -0,0 +1,176 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import cv2 as cv
+import numpy as np
+
+from lib import atomic_write
+
+
+def source_signature(src, frames=None):
+    """
+    Changes when the frames of a source change: size and mtime of a tar,
+    mtime and number of JPEGs of a directory (adding, removing or renaming
+    frames updates the mtime of the directory). frames: the JPEGs of the
+    directory if already listed.
+    """
+    st = os.stat(src)
+    if os.path.isdir(src):
+        if frames is None:
+            num_frames = sum(1 for x in os.scandir(src) if x.name.endswith('.jpg'))
+        else:
+            num_frames = len(frames)
+        return [st.st_mtime_ns, num_frames]
+    return [st.st_size, st.st_mtime_ns]
+
+
+class FeatureStore:
+    """
+    Keypoints and descriptors of the frames of one source, kept on disk so
+    that later runs of the filter on the same source skip decoding and
+    feature extraction.
+
+    Entries live in <root>/<key>/, where key hashes the absolute source path
+    and the extraction parameters:
+
+        index.json          source signature, frame name -> (chunk, start, count)
+        <chunk>.pts.npy     float32 (N, 2) keypoint coordinates
+        <chunk>.des.npy     (N, D) descriptors
+
+    Features are buffered and written as a new chunk every `chunk_size`
+    frames, chunks are read back with mmap. If the source changed since the
+    entry was written, the entry is deleted and rebuilt.
+    """
+    def __init__(self, root, src, params, chunk_size=256, frames=None):
+        key = json.dumps([os.path.abspath(src), params], sort_keys=True)
+        self.dir = os.path.join(root, hashlib.sha1(key.encode()).hexdigest())
+        self.index_path = os.path.join(self.dir, 'index.json')
+        self.chunk_size = chunk_size
+        self.signature = source_signature(src, frames)
+        self.params = params
+        self.lock = threading.Lock()
+        self.chunks = {}
+        self.buffer = []
+        self.im_size = None
+
+        os.makedirs(self.dir, exist_ok=True)
+        with self.file_lock():
+            index = self.read_index()
+            if index is None:
+                # new or outdated entry
+                self.clear()
+                index = self.empty_index()
+                self.write_index(index)
+        self.frames = index['frames']
+        self.im_size = index['im_size']
+
+    def empty_index(self):
+        return {
+            'src_signature': self.signature,
+            'params': self.params,
+            'im_size': None,
+            'frames': {},
+        }
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        # serialises index updates of processes sharing the store
+        with open(os.path.join(self.dir, 'lock'), 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def clear(self):
+        for fn in os.listdir(self.dir):
+            if fn != 'lock':
+                os.remove(os.path.join(self.dir, fn))
+
+    def read_index(self):
+        if not os.path.isfile(self.index_path):
+            return None
+        try:
+            with open(self.index_path) as fp:
+                index = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if index.get('src_signature') != self.signature:
+            return None
+        return index
+
+    def write_index(self, index):
+        with atomic_write(self.index_path) as fp:
+            json.dump(index, fp)
+
+    def chunk(self, name):
+        if name not in self.chunks:
+            path = os.path.join(self.dir, name)
+            self.chunks[name] = (
+                np.load(path + '.pts.npy', mmap_mode='r'),
+                np.load(path + '.des.npy', mmap_mode='r'),
+            )
+        return self.chunks[name]
+
+    def get(self, k):
+        name = os.path.basename(k)
+        with self.lock:
+            if name not in self.frames:
+                return None
+            chunk, start, count = self.frames[name]
+            if count == 0:
+                return np.zeros([0, 2], dtype=np.float32), None
+            pts, des = self.chunk(chunk)
+            return (
+                np.array(pts[start:start + count]),
+                np.array(des[start:start + count]),
+            )
+
+    def put(self, k, pts, des, im_size):
+        name = os.path.basename(k)
+        with self.lock:
+            self.im_size = im_size
+            self.buffer.append((name, pts, des))
+            if len(self.buffer) >= self.chunk_size:
+                self.flush_buffer()
+
+    def flush_buffer(self):
+        if not self.buffer:
+            return
+        buffer, self.buffer = self.buffer, []
+        descs = [des for _, _, des in buffer if des is not None]
+        if not descs:
+            # only frames without keypoints, still stored to skip them later
+            descs = [np.zeros([0, 128], dtype=np.float32)]
+        chunk = uuid.uuid4().hex
+        path = os.path.join(self.dir, chunk)
+        np.save(path + '.pts.npy', np.concatenate([pts for _, pts, _ in buffer]))
+        np.save(path + '.des.npy', np.concatenate(descs))
+        frames = {}
+        start = 0
+        for name, pts, _ in buffer:
+            frames[name] = [chunk, start, len(pts)]
+            start += len(pts)
+
+        with self.file_lock():
+            index = self.read_index() or self.empty_index()
+            index['frames'].update(frames)
+            index['im_size'] = self.im_size
+            self.write_index(index)
+        self.frames.update(frames)
+
+    def flush(self):
+        with self.lock:
+            self.flush_buffer()
+
+
+def make_feature_store(root, src, scale, backend='sift', reader_args=None, frames=None):
+    params = {'features': backend, 'scale': scale, 'opencv': cv.__version__}
+    # frame rate and size of videos
+    params.update({k: v for k, v in (reader_args or {}).items() if v is not None})
+    return FeatureStore(root, src, params, frames=frames)
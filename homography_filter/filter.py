@@ -5,19 +5,70 @@ import numpy as np
 from matplotlib import pyplot as plt
 from collections import defaultdict
 import time
+import json
+from concurrent.futures import ProcessPoolExecutor
 
 from lib import *
 from argparser import parse_args
+from feature_store import make_feature_store
+from pairs import EvaluatedPairs, pairs_path
 import cv2
 
 
+def video_reader_args(args):
+    return dict(fps=args.video_fps, longside=args.video_longside)
+
+
+def reader_args(args):
+    # the frames of a directory --src if the caller listed them
+    return dict(video_reader_args(args), frames=args.frames)
+
+
 def make_homography_loader(args):
 
-    images = Images(args.src, scale=args.filtering_scale)
+    cache = LRUCache(max_bytes=args.cache_mb * 2**20)
+    images = Images(
+        args.src, scale=args.filtering_scale, cache=cache,
+        reader_args=reader_args(args), stats=Stats(enabled=args.stats),
+    )
     print(f'Found {len(images.imreader.fpaths)} images.')
-    features = Features(images)
-    matches = Matches(features)
-    homographies = Homographies(images, features, matches)
+    store = None
+    if args.feature_cache is not None:
+        store = make_feature_store(
+            args.feature_cache, args.src, args.filtering_scale, args.features,
+            reader_args=video_reader_args(args), frames=args.frames,
+        )
+    # the pre-screen decides most pairs from thumbnails and KLT most of the
+    # others from tracks, features computed ahead would mostly be thrown away.
+    # The linear search matches whole pairs ahead, which computes their
+    # features too.
+    feature_workers = pair_workers = 0
+    if not args.prescreen and args.overlap_engine != 'klt':
+        if args.search == 'linear':
+            pair_workers = args.num_workers
+        else:
+            feature_workers = args.num_workers
+    features = Features(
+        images, num_workers=feature_workers, read_ahead=args.read_ahead,
+        store=store, backend=args.features, sequential=args.search == 'linear',
+    )
+    matches = Matches(features, match_mode=args.match_mode, matcher=args.matcher)
+    if args.overlap_engine == 'klt':
+        homographies = KLTHomographies(
+            images, features, matches,
+            num_workers=args.num_workers, read_ahead=args.read_ahead,
+        )
+    else:
+        homographies = Homographies(
+            images, features, matches, num_workers=pair_workers,
+        )
+    if args.save_pairs:
+        homographies.pairs = EvaluatedPairs(images.imreader.fpaths)
+    if args.prescreen:
+        # decided pairs are above every threshold
+        homographies = Prescreen(
+            homographies, threshold=max(args.overlap), margin=args.prescreen_margin
+        )
 
     return homographies
 
@@ -30,17 +81,202 @@ def save(fpaths_filtered, args):
     save_as_video(os.path.join(dir_dst, 'video'), fpaths_filtered, imreader)
 
 
-if __name__ == '__main__':
-
-    # set filtering to deterministic mode
-    cv2.setRNGSeed(0)
-    args = parse_args()
+def select_chunk(args, start, stop):
+    """ Selected frames of [start, stop) for every threshold. """
     homographies = make_homography_loader(args)
-    graph = calc_graph(homographies, **vars(args))
-    fpaths_filtered = graph2fpaths(graph)
-    lines = [os.path.basename(v)+'\n' for v in fpaths_filtered]
+    graphs = calc_graph(
+        homographies, **dict(vars(args), frame_range_min=start, frame_range_max=stop)
+    )
+    homographies.close()
+    chains = {
+        overlap: graph2chain(graph, start) for overlap, graph in graphs.items()
+    }
+    num_evaluated = {
+        overlap: graph['num_evaluated'] for overlap, graph in graphs.items()
+    }
+    stats = homographies.images.stats.summary(cache=homographies.images.cache)
+    pairs = None
+    if homographies.pairs is not None:
+        homographies.pairs.im_size = homographies.images.im_size
+        pairs = homographies.pairs.arrays()
+    return chains, num_evaluated, stats, pairs
+
+
+def calc_graph_chunked(args):
+    """
+    Runs the selection on args.num_chunks chunks of the frame range in
+    separate processes and stitches them, see stitch_chains. Each chunk
+    extends args.chunk_overlap frames into the next one, so that the chains
+    of neighbouring chunks usually meet and no frames are evaluated again.
+    The result equals a serial run of calc_graph. Returns the graphs, the
+    stats and the evaluated pairs (or None) of all processes.
+    """
+    if args.search != 'linear':
+        # a chunk end clamps the galloping probes, unlike a serial run
+        raise ValueError('--num_chunks needs the linear search.')
+    fpaths = ImageReader(args.src, **reader_args(args)).fpaths
+    frame_range_min = args.frame_range_min
+    frame_range_max = args.frame_range_max
+    if frame_range_max is None:
+        frame_range_max = len(fpaths)
+    starts = np.linspace(
+        frame_range_min, frame_range_max, args.num_chunks + 1
+    ).astype(int)[:-1]
+    stops = [min(x + args.chunk_overlap, frame_range_max) for x in starts[1:]]
+    stops.append(frame_range_max)
+
+    with ProcessPoolExecutor(max_workers=args.num_chunks) as executor:
+        results = list(executor.map(
+            select_chunk, [args] * len(starts), starts.tolist(), stops
+        ))
+
+    # frames no chunk knows the next selected frame of are computed here
+    homographies = None
+    graphs = {}
+    for overlap in args.overlap:
+        num_evaluated = sum(x[1][overlap] for x in results)
+
+        def step(i):
+            nonlocal homographies, num_evaluated
+            if homographies is None:
+                homographies = make_homography_loader(args)
+
+            def overlap_at(j):
+                nonlocal num_evaluated
+                num_evaluated += 1
+                homographies.images.stats.count('pairs_evaluated')
+                return homographies.overlap(fpaths[i], fpaths[j])
+
+            j = find_next_frame(overlap_at, i, frame_range_max, overlap)
+            homographies.release(fpaths[i])
+            return j
+
+        chain = stitch_chains(
+            [x[0][overlap] for x in results], step, frame_range_min
+        )
+        graphs[overlap] = chain2graph(chain, fpaths)
+        graphs[overlap]['num_evaluated'] = num_evaluated
+    stats = Stats(enabled=args.stats)
+    caches = []
+    pairs = EvaluatedPairs(fpaths) if args.save_pairs else None
+    for _, _, summary, arrays in results:
+        stats.merge(summary)
+        caches.append(summary['cache'])
+        if pairs is not None:
+            pairs.extend(arrays)
+    if homographies is not None:
+        homographies.close()
+        stats.merge(homographies.images.stats.summary())
+        if pairs is not None:
+            homographies.pairs.im_size = homographies.images.im_size
+            pairs.extend(homographies.pairs.arrays())
+    summary = stats.summary()
+    summary['cache'] = caches
+    return graphs, summary, pairs
+
+
+def dst_file_for(dst_file, overlap, overlaps):
+    # with several thresholds, <dir>/overlap_<t>/<name> for each of them
+    if len(overlaps) == 1:
+        return dst_file
+    dir_name, fn = os.path.split(dst_file)
+    return os.path.join(dir_name, f'overlap_{overlap}', fn)
+
+
+def stats_path(dst_file):
+    return os.path.splitext(dst_file)[0] + '.stats.json'
+
+
+def write_stats(args, summary, graphs, runtime):
+    """ Stats of the stages and of the selection as JSON next to --dst_file. """
+    frame_range_max = args.frame_range_max
+    if frame_range_max is None:
+        frame_range_max = len(ImageReader(args.src, **reader_args(args)).fpaths)
+    num_frames = frame_range_max - args.frame_range_min
+    summary = dict(
+        summary,
+        runtime=runtime,
+        num_frames=num_frames,
+        fps=num_frames / runtime,
+        selection={
+            str(overlap): {
+                'num_selected': len(graph2chain(graph, args.frame_range_min)),
+                'num_evaluated': graph['num_evaluated'],
+            }
+            for overlap, graph in graphs.items()
+        },
+    )
     dir_name = os.path.dirname(args.dst_file)
-    if not os.path.exists(dir_name):
+    if dir_name and not os.path.exists(dir_name):
         os.makedirs(dir_name)
-    with open(args.dst_file, 'w') as fp:
-        fp.writelines(lines)
\ No newline at end of file
+    with open(stats_path(args.dst_file), 'w') as fp:
+        json.dump(summary, fp, indent=1)
+
+
+def write_selected_frames(dst_file, fpaths_filtered):
+    lines = [os.path.basename(v)+'\n' for v in fpaths_filtered]
+    dir_name = os.path.dirname(dst_file)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    # the pipeline takes an existing list as done
+    with atomic_write(dst_file) as fp:
+        fp.writelines(lines)
+
+
+def run_filter(args):
+    """
+    Selects the frames of args.src and writes them as the command line
+    does. Returns the number of frames, the number of selected frames for
+    every threshold and the runtime.
+    """
+    # set filtering to deterministic mode
+    cv2.setRNGSeed(0)
+    t0 = time.perf_counter()
+    if args.num_chunks > 1:
+        graphs, summary, pairs = calc_graph_chunked(args)
+        runtime = time.perf_counter() - t0
+        num_frames = len(ImageReader(args.src, **reader_args(args)).fpaths)
+    else:
+        homographies = make_homography_loader(args)
+        graphs = calc_graph(homographies, **vars(args))
+        runtime = time.perf_counter() - t0
+        # after the search, which shortens videos that end early
+        num_frames = len(homographies.images.imreader.fpaths)
+        homographies.close()
+        summary = homographies.images.stats.summary(cache=homographies.images.cache)
+        pairs = homographies.pairs
+        if pairs is not None:
+            pairs.im_size = homographies.images.im_size
+        if args.prescreen:
+            print(homographies.report())
+            homographies = homographies.inner
+        if args.overlap_engine == 'klt':
+            print(f'{homographies.num_tracked} pairs tracked, '
+                  f'{homographies.num_fallback} fell back to feature matching')
+    if args.stats:
+        write_stats(args, summary, graphs, runtime)
+    if pairs is not None:
+        pairs.save(pairs_path(args.dst_file))
+    imreader = None
+    if args.dst_frames is not None:
+        imreader = ImageReader(args.src, **reader_args(args))
+    num_selected = {}
+    for overlap, graph in graphs.items():
+        fpaths_filtered = graph2fpaths(graph)
+        num_selected[overlap] = len(fpaths_filtered)
+        # the list last, an existing list means the frames are written too
+        if imreader is not None:
+            dir_dst = dst_file_for(args.dst_frames, overlap, args.overlap)
+            extract_frames(dir_dst, fpaths_filtered, imreader)
+        dst_file = dst_file_for(args.dst_file, overlap, args.overlap)
+        write_selected_frames(dst_file, fpaths_filtered)
+    return {
+        'src': args.src,
+        'num_frames': num_frames,
+        'num_selected': num_selected,
+        'runtime': runtime,
+    }
+
+
+if __name__ == '__main__':
+    run_filter(parse_args())
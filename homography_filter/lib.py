@@ -6,6 +6,12 @@ from collections import defaultdict
 import sys
 import os
 import shutil
+import threading
+import time
+import contextlib
+import functools
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
 
 
@@ -15,113 +21,697 @@ else:
     from tqdm import tqdm
 
 
+def nbytes_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(x) for x in value)
+    return 0
+
+
+class LRUCache:
+    """
+    Cache shared by Images, Features, Matches and Homographies. Once the
+    cached arrays take more than max_bytes, the least recently used values
+    of any stage are evicted. Each stage uses a view with its own keys and
+    hit / miss counters. Thread-safe, the read-ahead workers fill it too.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()  # (view name, key) -> (value, nbytes)
+        self.nbytes = 0
+        self.views = {}
+        self.lock = threading.RLock()
+
+    def view(self, name):
+        if name not in self.views:
+            self.views[name] = CacheView(self, name)
+        return self.views[name]
+
+    def set(self, view, k, value):
+        nbytes = nbytes_of(value)
+        with self.lock:
+            self.remove(view, k)
+            self.data[view.name, k] = (value, nbytes)
+            self.nbytes += nbytes
+            view.nbytes += nbytes
+            view.count += 1
+            # never evicts the value just added
+            while self.max_bytes is not None and self.nbytes > self.max_bytes \
+                    and len(self.data) > 1:
+                (name, k_), _ = next(iter(self.data.items()))
+                self.remove(self.views[name], k_)
+                self.views[name].evictions += 1
+
+    def remove(self, view, k):
+        with self.lock:
+            if (view.name, k) not in self.data:
+                return False
+            value, nbytes = self.data.pop((view.name, k))
+            self.nbytes -= nbytes
+            view.nbytes -= nbytes
+            view.count -= 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'nbytes': self.nbytes,
+                'views': {name: view.stats() for name, view in self.views.items()},
+            }
+
+
+class CacheView:
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+        self.nbytes = 0
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, k, default=None):
+        with self.cache.lock:
+            item = self.cache.data.get((self.name, k))
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.cache.data.move_to_end((self.name, k))
+            return item[0]
+
+    def __contains__(self, k):
+        return (self.name, k) in self.cache.data
+
+    def __setitem__(self, k, value):
+        self.cache.set(self, k, value)
+
+    def __delitem__(self, k):
+        if not self.cache.remove(self, k):
+            raise KeyError(k)
+
+    def pop(self, k, default=None):
+        with self.cache.lock:
+            item = self.cache.data.get((self.name, k))
+            if item is None:
+                return default
+            self.cache.remove(self, k)
+            return item[0]
+
+    def __len__(self):
+        return self.count
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'nbytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class Stats:
+    """
+    Timers, counters and distributions of values of the filter stages,
+    shared by Images, Features, Matches and Homographies as the cache.
+    Timers wrap the OpenCV calls of a stage only, so the time of one stage
+    never includes another. With several read-ahead workers, timers add
+    up the time of all threads. Disabled, every method returns at once.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.timers = defaultdict(lambda: [0, 0.0])  # name -> [count, seconds]
+        self.counters = defaultdict(int)
+        self.values = {}  # name -> [count, sum, min, max]
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += n
+
+    def add(self, name, value):
+        if not self.enabled:
+            return
+        value = float(value)
+        with self.lock:
+            v = self.values.get(name)
+            if v is None:
+                self.values[name] = [1, value, value, value]
+            else:
+                v[0] += 1
+                v[1] += value
+                v[2] = min(v[2], value)
+                v[3] = max(v[3], value)
+
+    def merge(self, summary):
+        """ Adds the timers, counters and values of another summary(). """
+        with self.lock:
+            for name, x in summary['timers'].items():
+                self.timers[name][0] += x['count']
+                self.timers[name][1] += x['seconds']
+            for name, n in summary['counters'].items():
+                self.counters[name] += n
+            for name, x in summary['values'].items():
+                v = self.values.setdefault(name, [0, 0.0, x['min'], x['max']])
+                v[0] += x['count']
+                v[1] += x['sum']
+                v[2] = min(v[2], x['min'])
+                v[3] = max(v[3], x['max'])
+
+    def summary(self, cache=None):
+        with self.lock:
+            summary = {
+                'timers': {
+                    name: {'count': n, 'seconds': t}
+                    for name, (n, t) in sorted(self.timers.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'values': {
+                    name: {'count': n, 'sum': total, 'mean': total / n,
+                           'min': lo, 'max': hi}
+                    for name, (n, total, lo, hi) in sorted(self.values.items())
+                },
+            }
+        if cache is not None:
+            summary['cache'] = cache.stats()
+        return summary
+
+
+class StageTimer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        with self.stats.lock:
+            timer = self.stats.timers[self.name]
+            timer[0] += 1
+            timer[1] += elapsed
+
+
+NULL_TIMER = contextlib.nullcontext()
+
+
 class Images:
-    def __init__(self, src, load_grey=True, scale=1):
-        self.images = {}
+    def __init__(self, src, load_grey=True, scale=1, cache=None, reader_args=None,
+                 stats=None):
+        if cache is None:
+            cache = LRUCache()
+        if stats is None:
+            stats = Stats()
+        self.cache = cache
+        self.stats = stats
+        self.images = cache.view('images')
         self.im_size = None
         self.src = src
         self.scale = scale
+        # further ImageReader arguments, e.g. fps and longside of videos
+        self.reader_args = reader_args or {}
         if load_grey:
-            self.imreader = ImageReader(src, scale=scale, cv_flag=cv.IMREAD_GRAYSCALE)
+            self.imreader = ImageReader(
+                src, scale=scale, cv_flag=cv.IMREAD_GRAYSCALE, **self.reader_args
+            )
         else:
-            self.imreader = ImageReader(src, scale=scale)
+            self.imreader = ImageReader(src, scale=scale, **self.reader_args)
 
     def __getitem__(self, k):
-        if k not in self.images:
-            im = self.imreader[k]
+        im = self.images.get(k)
+        if im is None:
+            with self.stats.timer('decode'):
+                im = self.imreader[k]
             self.images[k] = im
-            self.im_size = self.images[k].shape[:2]
-        return self.images[k]
+            # size at full resolution, features are in the same coordinates
+            self.im_size = tuple(x * self.scale for x in im.shape[:2])
+        return im
+
+
+class ReadAhead:
+    """
+    Runs `func` on the frames following the last requested one in a pool of
+    worker threads, keeping at most `depth` frames in flight. OpenCV releases
+    the GIL while decoding and extracting features, so the workers run in
+    parallel with the matching done by the caller.
+
+    With sequential=False nothing is run ahead on its own, only the frames
+    the caller announces with prefetch(), e.g. the next probes of a search
+    that skips frames. Several read-aheads can share the threads of `pool`,
+    which they do not shut down.
+    """
+    def __init__(self, func, fpaths, num_workers, depth, sequential=True, pool=None):
+        self.func = func
+        self.fpaths = fpaths
+        self.index = {fpath: i for i, fpath in enumerate(fpaths)}
+        self.depth = depth
+        self.sequential = sequential
+        self.own_pool = pool is None
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.pool = pool
+        self.pending = OrderedDict()
+        self.cursor = 0
+
+    def prefetch(self, ks):
+        for k in ks:
+            if k in self.pending:
+                continue
+            # the oldest announced frames are the least likely to be requested
+            if len(self.pending) >= self.depth:
+                self.pending.popitem(last=False)[1].cancel()
+            self.pending[k] = self.pool.submit(self.func, k)
+
+    def __call__(self, k):
+        i = self.index[k]
+        future = self.pending.pop(k, None)
+        if self.sequential:
+            # frames behind the cursor are not requested again, drop them
+            while self.pending and self.index[next(iter(self.pending))] < i:
+                self.pending.popitem(last=False)[1].cancel()
+            self.cursor = max(self.cursor, i + 1)
+            while len(self.pending) < self.depth and self.cursor < len(self.fpaths):
+                fpath = self.fpaths[self.cursor]
+                self.pending[fpath] = self.pool.submit(self.func, fpath)
+                self.cursor += 1
+        if future is None:
+            return self.func(k)
+        return future.result()
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self.own_pool:
+            self.pool.shutdown()
+
+
+class PairReadAhead:
+    """
+    Runs `func(k0, k)` on the pairs of an anchor frame k0 with the frames k
+    following the last requested pair of that anchor, as the linear search
+    requests them, in a pool of worker threads shared by all anchors. The
+    caller gets the result of each pair it requests, in the order it
+    requests them. release(k0) drops the pairs of an anchor that is not
+    tested again.
+
+    Pairs past the next selected frame are computed in vain, so only as
+    many pairs of each anchor as there are workers are in flight, enough to
+    keep them busy.
+    """
+    def __init__(self, func, fpaths, num_workers):
+        self.func = func
+        self.fpaths = fpaths
+        self.depth = num_workers
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        # k0 -> ReadAhead of the pairs of k0
+        self.anchors = {}
+
+    def __call__(self, k):
+        read_ahead = self.anchors.get(k[0])
+        if read_ahead is None:
+            read_ahead = ReadAhead(
+                functools.partial(self.func, k[0]), self.fpaths, 0, self.depth,
+                pool=self.pool,
+            )
+            self.anchors[k[0]] = read_ahead
+        return read_ahead(k[1])
+
+    def release(self, k0):
+        read_ahead = self.anchors.pop(k0, None)
+        if read_ahead is not None:
+            read_ahead.close()
+
+    def close(self):
+        for k0 in list(self.anchors):
+            self.release(k0)
+        self.pool.shutdown()
+
+
+# name: (detector constructor, binary descriptors)
+FEATURE_BACKENDS = {
+    'sift': (lambda: cv.SIFT_create(), False),
+    'orb': (lambda: cv.ORB_create(nfeatures=2000), True),
+    'akaze': (lambda: cv.AKAZE_create(), True),
+}
 
 
 class Features:
-    def __init__(self, images):
-        self.features = {}
+    """
+    Keypoints (at full resolution) and descriptors of a frame. With
+    num_workers > 0 they are computed ahead in a thread pool, of the
+    following frames if `sequential`, otherwise of the frames passed to
+    prefetch().
+    """
+    def __init__(self, images, num_workers=0, read_ahead=32, store=None, backend='sift',
+                 sequential=True):
+        self.features = images.cache.view('features')
         self.images = images
-        self.sift = cv.SIFT_create()
+        # optional persistent cache, see feature_store.FeatureStore
+        self.store = store
+        if backend not in FEATURE_BACKENDS:
+            raise ValueError(f'Unknown feature backend: {backend}')
+        self.backend = backend
+        self.create_detector, self.binary = FEATURE_BACKENDS[backend]
+        # detectors are not shared between threads
+        self.local = threading.local()
+        # frame -> Future of the thread extracting its features, see compute
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.read_ahead = None
+        if num_workers > 0:
+            self.read_ahead = ReadAhead(
+                self.extract, images.imreader.fpaths, num_workers, read_ahead,
+                sequential=sequential,
+            )
+
+    @property
+    def detector(self):
+        if not hasattr(self.local, 'detector'):
+            self.local.detector = self.create_detector()
+        return self.local.detector
+
+    def extract(self, k):
+        if self.store is not None:
+            cached = self.store.get(k)
+            if cached is not None:
+                if self.images.im_size is None:
+                    self.images.im_size = tuple(self.store.im_size)
+                self.images.stats.count('feature_store_hits')
+                return cached
+        im = self.images[k]
+        with self.images.stats.timer('features'):
+            kp, des = self.detector.detectAndCompute(im, None)
+        # the image is not used again once its features exist
+        self.images.images.pop(k)
+        # keypoint coordinates at full resolution, so that homographies
+        # and RANSAC thresholds do not depend on the decoding scale
+        pts = np.float32(cv.KeyPoint_convert(kp)).reshape(-1, 2)
+        pts *= self.images.scale
+        self.images.stats.add('keypoints', len(pts))
+        if self.store is not None:
+            self.store.put(k, pts, des, self.images.im_size)
+        return pts, des
+
+    def compute(self, k):
+        """
+        As extract, but threads asking for the same frame at once wait for
+        the first one instead of extracting it again.
+        """
+        with self.lock:
+            if k in self.features:
+                return self.features.get(k)
+            future = self.in_flight.get(k)
+            is_owner = future is None
+            if is_owner:
+                future = self.in_flight[k] = Future()
+        if not is_owner:
+            return future.result()
+        try:
+            features = self.extract(k)
+            self.features[k] = features
+            future.set_result(features)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[k]
+        return features
 
     def __getitem__(self, k):
-        if k not in self.features:
-            im = self.images[k]
-            kp, des = self.sift.detectAndCompute(im, None)
-            self.features[k] = (kp, des)
-        return self.features[k]
+        features = self.features.get(k)
+        if features is None:
+            if self.read_ahead is not None:
+                features = self.read_ahead(k)
+            else:
+                features = self.compute(k)
+            self.features[k] = features
+        return features
+
+    def prefetch(self, ks):
+        if self.read_ahead is not None:
+            self.read_ahead.prefetch([k for k in ks if k not in self.features])
+
+    def close(self):
+        if self.read_ahead is not None:
+            self.read_ahead.close()
+            self.read_ahead = None
+        if self.store is not None:
+            self.store.flush()
 
 
 class Matches:
-    def __init__(self, features):
+    """
+    Good matches of a pair of frames (k0, k1) as an (N, 2) array of keypoint
+    indices into k0 and k1.
+
+    match_mode='pair' matches k0 against a FLANN index built on k1 for every
+    pair. match_mode='anchor' builds the index on k0 once and reuses it
+    while k0 stays the same, which is the case for all frames j tested
+    against an anchor i in calc_graph. The ratio test is then applied from
+    k1 to k0, so the matches differ slightly from 'pair'.
+
+    matcher='flann' uses a KD-tree for float descriptors and LSH for binary
+    ones, matcher='bf' compares all descriptors (L2 or Hamming).
+    """
+    def __init__(self, features, match_mode='pair', matcher='flann'):
 
         FLANN_INDEX_KDTREE = 1
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-        search_params = dict(checks=50)
+        FLANN_INDEX_LSH = 6
+        if features.binary:
+            self.index_params = dict(
+                algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12,
+                multi_probe_level=1,
+            )
+            self.norm = cv.NORM_HAMMING
+        else:
+            self.index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+            self.norm = cv.NORM_L2
+        self.search_params = dict(checks=50)
         self.features = features
-        self.matcher = cv.FlannBasedMatcher(index_params, search_params)
-        self.matches = {}
+        if matcher not in ['flann', 'bf']:
+            raise ValueError(f'Unknown matcher: {matcher}')
+        self.matcher_type = matcher
+        # matchers are not shared between threads, see Homographies
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.matches = features.images.cache.view('matches')
         self.for_panorama_stitching = False
+        if match_mode not in ['pair', 'anchor']:
+            raise ValueError(f'Unknown match mode: {match_mode}')
+        self.match_mode = match_mode
+        # k0 -> FLANN index on the descriptors of k0, several anchors are
+        # active when calc_graph selects frames for several thresholds
+        self.anchors = OrderedDict()
+        self.max_anchors = 8
+        # FLANN builds its randomised trees with the OpenCV RNG, reseeding it
+        # for each pair makes the matches independent of the order in which
+        # pairs are evaluated, and of the thread, the RNG is per thread
+        self.seed = 0
 
-    def __getitem__(self, k):
-        if k not in self.matches:
-            (kp1, des1) = self.features[k[0]]
-            (kp2, des2) = self.features[k[1]]
-            if len(kp1) > 8:
-                try:
-                    matches = self.matcher.knnMatch(des1, des2, k=2)
-                except cv.error as e:
-                    print('NOTE: Too few keypoints for matching, skip.')
-                    matches = zip([], [])
+    @property
+    def matcher(self):
+        if not hasattr(self.local, 'matcher'):
+            if self.matcher_type == 'flann':
+                self.local.matcher = cv.FlannBasedMatcher(self.index_params, self.search_params)
             else:
-                matches = zip([], [])
-            # store all the good matches as per Lowe's ratio test.
-            good = []
-            for m, n in matches:
-                if m.distance < 0.7 * n.distance:
-                    good.append(m)
-            self.matches[k] = good
+                self.local.matcher = cv.BFMatcher(self.norm)
+        return self.local.matcher
 
-        return self.matches[k]
+    def match_pair(self, des1, des2):
+        try:
+            cv.setRNGSeed(self.seed)
+            matches = self.matcher.knnMatch(des1, des2, k=2)
+        except cv.error as e:
+            print('NOTE: Too few keypoints for matching, skip.')
+            matches = []
+        # store all the good matches as per Lowe's ratio test.
+        good = []
+        for knn in matches:
+            # LSH may find less than two neighbours
+            if len(knn) == 2 and knn[0].distance < 0.7 * knn[1].distance:
+                good.append((knn[0].queryIdx, knn[0].trainIdx))
+        return np.int64(good).reshape(-1, 2)
+
+    def match_anchor(self, k0, des1, des2):
+        if des2 is None or len(des2) == 0 or len(des1) < 2:
+            return np.zeros([0, 2], dtype=np.int64)
+        if self.matcher_type == 'bf':
+            # nothing to reuse, but vectorised as the FLANN case
+            dist, idx = cv.batchDistance(
+                des2, des1, -1, normType=self.norm, K=2
+            )
+            ratio = 0.7
+        else:
+            with self.lock:
+                index = self.anchors.get(k0)
+                if index is None:
+                    cv.setRNGSeed(self.seed)
+                    index = cv.flann_Index(des1, self.index_params)
+                    self.anchors[k0] = index
+                    if len(self.anchors) > self.max_anchors:
+                        self.anchors.popitem(last=False)
+                self.anchors.move_to_end(k0)
+            idx, dist = index.knnSearch(des2, 2, params=self.search_params)
+            # the KD-tree returns squared L2 distances, 0.7 ** 2 = 0.49
+            ratio = 0.7 if self.norm == cv.NORM_HAMMING else 0.49
+        # LSH returns -1 for missing neighbours
+        is_good = (idx[:, 1] >= 0) & (dist[:, 0] < ratio * dist[:, 1])
+        return np.stack(
+            [idx[is_good, 0].astype(np.int64), np.flatnonzero(is_good)], axis=1
+        )
+
+    def match(self, k, features=None):
+        """
+        Good matches of k without caching them, from any thread. features:
+        those of k[0] and k[1] if already at hand.
+        """
+        if features is None:
+            features = self.features[k[0]], self.features[k[1]]
+        (pts1, des1), (pts2, des2) = features
+        with self.features.images.stats.timer('match'):
+            if len(pts1) <= 8:
+                return np.zeros([0, 2], dtype=np.int64)
+            elif self.match_mode == 'anchor':
+                return self.match_anchor(k[0], des1, des2)
+            return self.match_pair(des1, des2)
+
+    def add(self, k, good):
+        self.features.images.stats.add('good_matches', len(good))
+        self.matches[k] = good
+
+    def __getitem__(self, k):
+        good = self.matches.get(k)
+        if good is None:
+            good = self.match(k)
+            self.add(k, good)
+
+        return good
 
 
 class Homographies:
-    def __init__(self, images, features, matches):
+    """
+    Homography of a pair of frames (k0, k1) fitted with RANSAC to their
+    matches.
+
+    With num_workers > 0 the pairs of an anchor k0 with the frames
+    following the last requested one are matched and fitted ahead in a
+    thread pool, together with the features of these frames, as the
+    linear search requests them, see PairReadAhead. Matching is reseeded
+    for every pair and RANSAC seeds its own generator, so the results do
+    not depend on the thread or the order pairs are computed in.
+    """
+    def __init__(self, images, features, matches, num_workers=0):
         self.matches = matches
-        self.homographies = {}
+        self.homographies = images.cache.view('homographies')
         self.images = images
         self.features = features
         self.warps = {}
         self.min_match_count = 10
-        self.images_rgb = ImageReader(src=self.images.src, scale=self.images.scale)
+        self._images_rgb = None
+        # optional recorder of the evaluated pairs, see pairs.EvaluatedPairs
+        self.pairs = None
+        self.pair_read_ahead = None
+        if num_workers > 0:
+            self.pair_read_ahead = PairReadAhead(
+                self.compute, images.imreader.fpaths, num_workers
+            )
+
+    @property
+    def images_rgb(self):
+        # only for drawing, full resolution as the keypoint coordinates
+        if self._images_rgb is None:
+            self._images_rgb = ImageReader(src=self.images.src, **self.images.reader_args)
+        return self._images_rgb
+
+    def fit(self, k, good, features=None):
+        """ (M, mask) of k from its matches, (None, None) if too few. """
+        if len(good) <= self.min_match_count:
+            # print( "Not enough matches are found - {}/{}".format(len(good), self.min_match_count) )
+            return None, None
+        if features is None:
+            features = self.features[k[0]], self.features[k[1]]
+        (pts1, _), (pts2, _) = features
+        src_pts = pts1[good[:, 0]].reshape(-1, 1, 2)
+        dst_pts = pts2[good[:, 1]].reshape(-1, 1, 2)
+        with self.images.stats.timer('ransac'):
+            return cv.findHomography(src_pts, dst_pts, cv.RANSAC, 5.0)
+
+    def compute(self, k0, k1):
+        """
+        Matches and homography of (k0, k1) without caching them, from any
+        thread. None if the features of the anchor k0 are gone, once the
+        search moved on from it.
+        """
+        features0 = self.features.features.get(k0)
+        if features0 is None:
+            return None
+        features = features0, self.features[k1]
+        good = self.matches.match((k0, k1), features)
+        return good, self.fit((k0, k1), good, features)
 
     def __getitem__(self, k):
-        good = self.matches[k]
-        kp1, _ = self.features[k[0]]
-        kp2, _ = self.features[k[1]]
-        img2 = self.images[k[1]]
-        if k not in self.homographies:
-            if len(good) > self.min_match_count:
-                src_pts = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(
-                    -1, 1, 2
-                )
-                dst_pts = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(
-                    -1, 1, 2
-                )
-                M, mask = cv.findHomography(src_pts, dst_pts, cv.RANSAC, 5.0)
-                self.homographies[k] = (M, mask)
+        homography = self.homographies.get(k)
+        if homography is None:
+            computed = None
+            if self.pair_read_ahead is not None:
+                # the features of the anchor once, before its pairs are run ahead
+                self.features[k[0]]
+                computed = self.pair_read_ahead(k)
+            if computed is None:
+                good = self.matches[k]
+                homography = self.fit(k, good)
             else:
-                # print( "Not enough matches are found - {}/{}".format(len(good), self.min_match_count) )
-                matchesMask = None
-                self.homographies[k] = (None, None)
-        return self.homographies[k]
+                good, homography = computed
+                if k not in self.matches.matches:
+                    self.matches.add(k, good)
+            stats = self.images.stats
+            if len(good) <= self.min_match_count:
+                stats.count('too_few_matches')
+            elif homography[1] is not None:
+                stats.add('inlier_ratio', homography[1].mean())
+            self.homographies[k] = homography
+        return homography
+
+    def overlap(self, *k):
+        """
+        Overlap of frames k[0] and k[1] from the homography and the image
+        size only, without decoding or drawing anything.
+        """
+        M, mask = self[k]
+        overlap = 0 if M is None else homography_overlap(M, self.images.im_size)
+        if self.pairs is not None:
+            self.pairs.add(k, M, 0 if mask is None else int(mask.sum()), overlap)
+        return overlap
 
     def calc_overlap(self, *k, vis=False, is_debug=False, with_warp=False, draw_matches=True):
+        """
+        As overlap(), also returns the matches and the second frame with
+        the first one's outline drawn, with the matches if is_debug. Decodes
+        both frames in colour, use overlap() if only the value is needed.
+        """
         img1 = self.images_rgb[k[0]].copy()
         img2 = self.images_rgb[k[1]].copy()
-        kp1, _ = self.features[k[0]]
-        kp2, _ = self.features[k[1]]
+        pts1, _ = self.features[k[0]]
+        pts2, _ = self.features[k[1]]
         good = self.matches[k]
-        h, w, c = img1.shape
         M, mask = self[k]
+        h, w = self.images.im_size
 
         if M is None:
+            if self.pairs is not None:
+                self.pairs.add(k, None, 0, 0)
             return 0, [], np.zeros([h, w * 2])
 
         matchesMask = mask.ravel().tolist()
@@ -144,7 +734,10 @@ class Homographies:
 
         if is_debug:
             if draw_matches:
-                im_matches = cv.drawMatches(img1, kp1, img2, kp2, good, None, **draw_params)
+                kp1 = cv.KeyPoint_convert(pts1)
+                kp2 = cv.KeyPoint_convert(pts2)
+                dmatches = [cv.DMatch(int(a), int(b), 0) for a, b in good]
+                im_matches = cv.drawMatches(img1, kp1, img2, kp2, dmatches, None, **draw_params)
             else:
                 im_matches = img2
             if vis:
@@ -153,13 +746,347 @@ class Homographies:
         else:
             im_matches = img2
 
-        image_area = self.images.im_size[0] * self.images.im_size[1]
-        polygon = dst.copy()[:, 0]
-        polygon = bound_polygon(polygon, im_size=self.images.im_size)
-        overlap = polygon_area(polygon[:, 1], polygon[:, 0]) / image_area
+        overlap = homography_overlap(M, self.images.im_size)
+        if self.pairs is not None:
+            self.pairs.add(k, M, int(mask.sum()), overlap)
 
         return overlap, good, im_matches
 
+    def prefetch(self, ks):
+        """ Frames whose pairs with the current anchor are evaluated next. """
+        self.features.prefetch(ks)
+
+    def release(self, k0):
+        """ Anchor k0 is not tested again, drop the pairs run ahead for it. """
+        if self.pair_read_ahead is not None:
+            self.pair_read_ahead.release(k0)
+
+    def close(self):
+        if self.pair_read_ahead is not None:
+            self.pair_read_ahead.close()
+            self.pair_read_ahead = None
+        self.features.close()
+
+
+class Track:
+    """ Corners of an anchor frame tracked up to frame t. """
+    def __init__(self, anchor, image, pts, pts_anchor):
+        self.anchor = anchor
+        self.t = anchor
+        self.image = image
+        # corners in frame t (decoded) and in the anchor (full resolution)
+        self.pts = pts
+        self.pts_anchor = pts_anchor
+        # corners found by the last detection
+        self.num_detected = len(pts)
+        # frame -> (M, mask) from the anchor to the frame
+        self.homographies = {}
+        # first frame the tracks were lost in, later frames fall back
+        self.failed_at = None
+
+
+class KLTHomographies(Homographies):
+    """
+    Homographies from an anchor frame to the following frames fitted to
+    corners tracked with pyramidal Lucas-Kanade, frame by frame from the
+    anchor on, instead of matched descriptors.
+
+    Tracks that fail the forward-backward check or are RANSAC outliers are
+    dropped. When less than `redetect_ratio` of the corners of the last
+    detection are left, corners are detected again in the current frame and mapped back to the
+    anchor with the homography of that frame. Once fewer than
+    `min_match_count` tracks survive, pairs of that anchor fall back to
+    the feature matching of Homographies.
+
+    Every pair (i, j) is computed from the same tracks through frames
+    i..j, so the overlap does not depend on the order pairs are evaluated.
+    """
+    def __init__(self, images, features, matches, num_workers=0, read_ahead=32):
+        super().__init__(images, features, matches)
+        self.index = {fpath: i for i, fpath in enumerate(images.imreader.fpaths)}
+        self.fpaths = images.imreader.fpaths
+        self.max_corners = 300
+        self.redetect_ratio = 0.5
+        self.corner_params = dict(qualityLevel=0.01, minDistance=7, blockSize=7)
+        self.lk_params = dict(
+            winSize=(15, 15), maxLevel=2,
+            criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 20, 0.03),
+        )
+        # forward-backward error in decoded pixels
+        self.max_fb_error = 1.0
+        # anchor -> Track, several anchors are active as in Matches
+        self.tracks = OrderedDict()
+        self.max_anchors = 8
+        self.num_tracked = 0
+        self.num_fallback = 0
+        self.read_ahead = None
+        if num_workers > 0:
+            self.read_ahead = ReadAhead(
+                images.__getitem__, self.fpaths, num_workers, read_ahead
+            )
+
+    def frame(self, t):
+        if self.read_ahead is not None:
+            return self.read_ahead(self.fpaths[t])
+        return self.images[self.fpaths[t]]
+
+    def detect(self, im):
+        with self.images.stats.timer('corners'):
+            pts = cv.goodFeaturesToTrack(im, self.max_corners, **self.corner_params)
+        if pts is None:
+            return np.zeros([0, 2], dtype=np.float32)
+        return pts.reshape(-1, 2)
+
+    def start_track(self, i):
+        im = self.frame(i)
+        pts = self.detect(im)
+        track = Track(i, im, pts, pts * self.images.scale)
+        if len(track.pts) < self.min_match_count:
+            track.failed_at = i + 1
+        return track
+
+    def step(self, track):
+        """ Tracks the corners from frame t to t + 1. """
+        t = track.t + 1
+        im = self.frame(t)
+        stats = self.images.stats
+        p0 = track.pts.reshape(-1, 1, 2)
+        with stats.timer('track'):
+            p1, st1, _ = cv.calcOpticalFlowPyrLK(track.image, im, p0, None, **self.lk_params)
+            p0r, st0, _ = cv.calcOpticalFlowPyrLK(im, track.image, p1, None, **self.lk_params)
+        fb_error = np.linalg.norm((p0 - p0r).reshape(-1, 2), axis=1)
+        good = (st1.ravel() == 1) & (st0.ravel() == 1) & (fb_error < self.max_fb_error)
+        pts_anchor = track.pts_anchor[good]
+        pts = p1.reshape(-1, 2)[good]
+        track.t, track.image = t, im
+
+        M = None
+        stats.add('tracks', len(pts))
+        if len(pts) > self.min_match_count:
+            with stats.timer('ransac'):
+                M, mask = cv.findHomography(
+                    pts_anchor.reshape(-1, 1, 2),
+                    (pts * self.images.scale).reshape(-1, 1, 2),
+                    cv.RANSAC, 5.0,
+                )
+        if M is None or mask.sum() <= self.min_match_count:
+            track.failed_at = t
+            track.image = None
+            return
+        track.homographies[t] = (M, mask)
+        stats.add('inlier_ratio', mask.mean())
+        inliers = mask.ravel() == 1
+        track.pts_anchor, track.pts = pts_anchor[inliers], pts[inliers]
+
+        if len(track.pts) < self.redetect_ratio * track.num_detected:
+            pts = self.detect(im)
+            track.num_detected = len(pts)
+            stats.count('klt_redetections')
+            if len(pts) > len(track.pts):
+                track.pts = pts
+                track.pts_anchor = cv.perspectiveTransform(
+                    (pts * self.images.scale).reshape(-1, 1, 2), np.linalg.inv(M)
+                ).reshape(-1, 2)
+
+    def track(self, i, j):
+        """ (M, mask) of frames i and j, None if the tracks were lost. """
+        k0 = self.fpaths[i]
+        if k0 not in self.tracks:
+            self.tracks[k0] = self.start_track(i)
+            if len(self.tracks) > self.max_anchors:
+                self.tracks.popitem(last=False)
+        self.tracks.move_to_end(k0)
+        track = self.tracks[k0]
+        while track.t < j and track.failed_at is None:
+            self.step(track)
+        return track.homographies.get(j)
+
+    def __getitem__(self, k):
+        homography = self.homographies.get(k)
+        if homography is None:
+            i, j = self.index[k[0]], self.index[k[1]]
+            homography = self.track(i, j) if j > i else None
+            if homography is None:
+                self.num_fallback += 1
+                self.images.stats.count('klt_fallback')
+                return super().__getitem__(k)
+            self.num_tracked += 1
+            self.images.stats.count('klt_tracked')
+            self.homographies[k] = homography
+        return homography
+
+    def calc_overlap(self, *k, **kwargs):
+        # the inlier mask belongs to the tracks, not to the matches
+        kwargs['draw_matches'] = False
+        return super().calc_overlap(*k, **kwargs)
+
+    def close(self):
+        if self.read_ahead is not None:
+            self.read_ahead.close()
+            self.read_ahead = None
+        super().close()
+
+
+class Prescreen:
+    """
+    Wraps an overlap engine (Homographies, KLTHomographies) with a cheap
+    estimate of the overlap: a similarity transform (rotation, scale and
+    shift) fitted to the shifts of a grid of patches of small thumbnails
+    of the two frames, each found by phase correlation. Pairs whose
+    estimate is at least `margin` above `threshold`, with confident
+    correlation peaks in all patches, are not passed to the engine, so no
+    features are computed for them. All other pairs, and every selected
+    frame, are checked by the engine.
+
+    `margin` and `min_response` trade speed for agreement with the engine,
+    see report().
+    """
+    def __init__(self, homographies, threshold, margin=0.05, thumbnail_width=128,
+                 grid=2, min_response=0.2):
+        self.inner = homographies
+        self.thumbnails = homographies.images.cache.view('thumbnails')
+        self.threshold = threshold
+        self.margin = margin
+        self.thumbnail_width = thumbnail_width
+        self.grid = grid
+        self.min_response = min_response
+        self.window = None
+        self.num_screened = 0
+        self.num_decided = 0
+        # escalated pairs the engine found clearly above the threshold
+        self.num_missed = 0
+
+    def __getattr__(self, name):
+        # images, features, matches, homographies and close() of the engine
+        return getattr(self.inner, name)
+
+    def thumbnail(self, k):
+        thumbnail = self.thumbnails.get(k)
+        if thumbnail is None:
+            im = self.images[k]
+            h, w = im.shape[:2]
+            size = (self.thumbnail_width, max(1, round(h * self.thumbnail_width / w)))
+            thumbnail = np.float32(cv.resize(im, size, interpolation=cv.INTER_AREA))
+            self.thumbnails[k] = thumbnail
+        return thumbnail
+
+    def estimate(self, *k):
+        """ Overlap under the fitted similarity, lowest peak response, similarity. """
+        t0 = self.thumbnail(k[0])
+        t1 = self.thumbnail(k[1])
+        h, w = t0.shape
+        ph, pw = h // self.grid, w // self.grid
+        if self.window is None:
+            self.window = cv.createHanningWindow((pw, ph), cv.CV_32F)
+        centres, shifted, responses = [], [], []
+        with self.images.stats.timer('prescreen'):
+            for y in range(0, ph * self.grid, ph):
+                for x in range(0, pw * self.grid, pw):
+                    (dx, dy), response = cv.phaseCorrelate(
+                        t0[y:y + ph, x:x + pw], t1[y:y + ph, x:x + pw], self.window
+                    )
+                    centres.append((x + pw / 2, y + ph / 2))
+                    shifted.append((x + pw / 2 + dx, y + ph / 2 + dy))
+                    responses.append(response)
+            A, _ = cv.estimateAffinePartial2D(
+                np.float32(centres), np.float32(shifted), method=cv.LMEDS
+            )
+        if A is None:
+            return 0, 0, None
+        # to full resolution
+        S = np.diag([self.images.im_size[1] / w] * 2 + [1])
+        M = S @ np.vstack([A, [0, 0, 1]]) @ np.linalg.inv(S)
+        return homography_overlap(M, self.images.im_size), min(responses), M
+
+    def overlap(self, *k):
+        estimate, response, M = self.estimate(*k)
+        self.num_screened += 1
+        stats = self.images.stats
+        if response >= self.min_response and estimate >= self.threshold + self.margin:
+            self.num_decided += 1
+            stats.count('prescreen_decided')
+            if self.pairs is not None:
+                # no inliers, the homography is the estimated similarity
+                self.pairs.add(k, M, -1, estimate)
+            return estimate
+        overlap = self.inner.overlap(*k)
+        stats.count('prescreen_escalated')
+        stats.add('prescreen_error', abs(estimate - overlap))
+        if overlap >= self.threshold + self.margin:
+            self.num_missed += 1
+            stats.count('prescreen_missed')
+        return overlap
+
+    def report(self):
+        num_escalated = self.num_screened - self.num_decided
+        hit_rate = self.num_decided / max(self.num_screened, 1)
+        report = (
+            f'prescreen: {self.num_decided} of {self.num_screened} pairs '
+            f'({100 * hit_rate:.1f}%) decided from thumbnails, '
+            f'{num_escalated} escalated, of which {self.num_missed} were '
+            f'above threshold + margin'
+        )
+        # with --stats
+        error = self.images.stats.summary()['values'].get('prescreen_error')
+        if error is not None:
+            report += f', mean |estimate - overlap| of the escalated pairs {error["mean"]:.3f}'
+        return report
+
+
+def homography_overlap(M, im_size):
+    """ Fraction of the image covered by the image warped with M. """
+    h, w = im_size
+    pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(
+        -1, 1, 2
+    )
+    polygon = cv.perspectiveTransform(pts, M)[:, 0]
+    polygon = bound_polygon(polygon, im_size=im_size)
+    return polygon_area(polygon[:, 1], polygon[:, 0]) / (h * w)
+
+
+def find_next_frame(overlap_at, i, stop, overlap, search='linear', prefetch=None):
+    """
+    Returns the first frame j in (i, stop) with overlap_at(j) < overlap, or
+    None if there is none.
+
+    search='linear' tests i+1, i+2, ... . search='gallop' probes i+1, i+2,
+    i+4, ... until the overlap drops below the threshold and then bisects
+    the last interval, evaluating O(log(j - i)) pairs. Both agree as long as
+    the overlap decreases monotonically with j, which is not guaranteed.
+
+    prefetch(js), if given, is called by the galloping search with the probe
+    following the current one, so that its features are computed while the
+    current pair is evaluated. The bisection probes depend on the result of
+    the previous one and are not announced.
+    """
+    if search == 'linear':
+        for j in range(i + 1, stop):
+            if overlap_at(j) < overlap:
+                return j
+        return None
+    elif search == 'gallop':
+        # lo: last frame above the threshold, hi: first one found below
+        lo, step = i, 1
+        while True:
+            hi = min(i + step, stop - 1)
+            if hi <= lo:
+                return None
+            if prefetch is not None and min(i + 2 * step, stop - 1) > hi:
+                prefetch([min(i + 2 * step, stop - 1)])
+            if overlap_at(hi) < overlap:
+                break
+            lo = hi
+            step *= 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if overlap_at(mid) < overlap:
+                hi = mid
+            else:
+                lo = mid
+        return hi
+    raise ValueError(f'Unknown search: {search}')
+
+
 def calc_graph(
     homographies,
     return_im_matches=False,
@@ -168,49 +1095,234 @@ def calc_graph(
     frame_range_max=None,
     is_debug=False,
     clear_cache=True,
+    search='linear',
     **kwargs,
 ):
+    """
+    Selects frames for the threshold `overlap`, or for each of a list of
+    thresholds, and returns {threshold: graph}.
 
-    fpaths = homographies.images.imreader.fpaths
+    The linear search selects for all thresholds in one pass, see
+    calc_graphs. The galloping search probes different frames for each
+    threshold and runs one pass per threshold; the passes share the cached
+    features and homographies, which are only cleared by the last one.
+    """
     print(overlap)
-    graph = {'im_matches': {}, 'fpaths': {}}
+    if not isinstance(overlap, (list, tuple)):
+        overlap = [overlap]
     if frame_range_max is None:
-        frame_range_max = len(fpaths)
+        frame_range_max = len(homographies.images.imreader.fpaths)
+    if len(overlap) > 1 and search == 'linear':
+        return calc_graphs(
+            homographies, overlap, frame_range_min, frame_range_max,
+            is_debug=is_debug, clear_cache=clear_cache, search=search,
+        )
+    return {
+        x: select_frames(
+            homographies, x, frame_range_min, frame_range_max, is_debug=is_debug,
+            clear_cache=clear_cache and n == len(overlap) - 1, search=search,
+        )
+        for n, x in enumerate(overlap)
+    }
+
+
+def select_frames(
+    homographies,
+    overlap,
+    frame_range_min,
+    frame_range_max,
+    is_debug=False,
+    clear_cache=True,
+    search='linear',
+):
+    """ Graph of the frames selected for one threshold, see calc_graph. """
+    fpaths = homographies.images.imreader.fpaths
+    # of Prescreen
+    thumbnails = homographies.images.cache.view('thumbnails')
+    graph = {'im_matches': {}, 'fpaths': {}, 'num_evaluated': 0}
     i = frame_range_min
-    j = i + 1
     pbar = tqdm(total=frame_range_max - frame_range_min - 1)
-    while i < frame_range_max - 1 and j < frame_range_max:
-        j = i + 1
-        while j < frame_range_max:
-            pbar.update(1)
-            overlap_ij, matches, im_matches = homographies.calc_overlap(
-                fpaths[i],
-                fpaths[j],
-                vis=False,
-                is_debug=is_debug,
-            )
-            if overlap_ij < overlap:
-                if is_debug:
-                    graph['im_matches'][i, j] = im_matches
-                graph['fpaths'][i, j] = [fpaths[i], fpaths[j]]
-                if clear_cache:
-                    i_ = i
-                    pi = fpaths[i_]
-                    del homographies.images.images[pi]
-                    del homographies.features.features[pi]
-                    for j_ in range(i_+1, j+1):
-                        pj = fpaths[j_]
-                        del homographies.homographies[(pi, pj)]
-                        del homographies.matches.matches[(pi, pj)]
-                        del homographies.images.images[pj]
-                        del homographies.features.features[pj]
-                i = j
-                break
-            j += 1
+    while i < frame_range_max - 1:
+        evaluated = {}
+
+        def overlap_at(j):
+            if is_debug:
+                overlap_ij, matches, im_matches = homographies.calc_overlap(
+                    fpaths[i],
+                    fpaths[j],
+                    vis=False,
+                    is_debug=is_debug,
+                )
+            else:
+                overlap_ij, im_matches = homographies.overlap(fpaths[i], fpaths[j]), None
+            evaluated[j] = im_matches
+            return overlap_ij
+
+        def prefetch(js):
+            homographies.prefetch([fpaths[j] for j in js])
+
+        try:
+            j = find_next_frame(overlap_at, i, frame_range_max, overlap, search, prefetch)
+        except IndexError:
+            if len(fpaths) >= frame_range_max:
+                raise
+            # the video ended before its frame count, see VideoFrames; search
+            # again up to the end as if the count had been right
+            frame_range_max = len(fpaths)
+            continue
+        homographies.release(fpaths[i])
+        graph['num_evaluated'] += len(evaluated)
+        homographies.images.stats.count('pairs_evaluated', len(evaluated))
+        if j is None:
+            pbar.update(frame_range_max - 1 - i)
+            break
+        pbar.update(j - i)
+        homographies.images.stats.add(f'pairs_per_selected@{overlap}', len(evaluated))
+        if is_debug:
+            graph['im_matches'][i, j] = evaluated[j]
+        graph['fpaths'][i, j] = [fpaths[i], fpaths[j]]
+        if clear_cache:
+            pi = fpaths[i]
+            homographies.matches.anchors.pop(pi, None)
+            for j_ in evaluated:
+                pj = fpaths[j_]
+                homographies.homographies.pop((pi, pj), None)
+                homographies.matches.matches.pop((pi, pj), None)
+            # j is the next anchor, keep its features
+            for j_ in range(i, j):
+                pj = fpaths[j_]
+                homographies.images.images.pop(pj, None)
+                homographies.features.features.pop(pj, None)
+                thumbnails.pop(pj, None)
+        i = j
     pbar.close()
     return graph
 
 
+def calc_graphs(
+    homographies,
+    overlaps,
+    frame_range_min=0,
+    frame_range_max=None,
+    is_debug=False,
+    clear_cache=True,
+    search='linear',
+):
+    """
+    Selects frames for several overlap thresholds in one pass and returns
+    {threshold: graph}, each graph as returned by select_frames for that
+    threshold alone.
+
+    The linear scans of all thresholds advance together over j. Features of
+    j are computed once, and a pair (i, j) is evaluated once for all the
+    thresholds whose current anchor is i; at the start and after every frame
+    selected by all thresholds, they all share the anchor.
+    """
+    if search != 'linear':
+        raise ValueError('Several overlap thresholds need the linear search.')
+    fpaths = homographies.images.imreader.fpaths
+    if frame_range_max is None:
+        frame_range_max = len(fpaths)
+    graphs = {
+        overlap: {'im_matches': {}, 'fpaths': {}, 'num_evaluated': 0}
+        for overlap in overlaps
+    }
+    anchors = {overlap: frame_range_min for overlap in overlaps}
+    stats = homographies.images.stats
+    # of Prescreen
+    thumbnails = homographies.images.cache.view('thumbnails')
+    for j in tqdm(range(frame_range_min + 1, frame_range_max)):
+        evaluated = {}
+        try:
+            for overlap, graph in graphs.items():
+                i = anchors[overlap]
+                if i not in evaluated:
+                    if is_debug:
+                        evaluated[i] = homographies.calc_overlap(
+                            fpaths[i],
+                            fpaths[j],
+                            vis=False,
+                            is_debug=is_debug,
+                        )
+                    else:
+                        overlap_ij = homographies.overlap(fpaths[i], fpaths[j])
+                        evaluated[i] = overlap_ij, None, None
+                graph['num_evaluated'] += 1
+                overlap_ij, matches, im_matches = evaluated[i]
+                if overlap_ij < overlap:
+                    # the linear scan evaluated all frames since the anchor
+                    stats.add(f'pairs_per_selected@{overlap}', j - i)
+                    if is_debug:
+                        graph['im_matches'][i, j] = im_matches
+                    graph['fpaths'][i, j] = [fpaths[i], fpaths[j]]
+                    anchors[overlap] = j
+        except IndexError:
+            if j < len(fpaths):
+                raise
+            # the video ended before its frame count, see VideoFrames
+            break
+        stats.count('pairs_evaluated', len(evaluated))
+        active = set(anchors.values())
+        for i in evaluated:
+            if i not in active:
+                homographies.release(fpaths[i])
+        if clear_cache:
+            # pairs are not evaluated twice, frames are needed again only
+            # while they are the anchor of some threshold
+            pj = fpaths[j]
+            for i in evaluated:
+                pi = fpaths[i]
+                homographies.homographies.pop((pi, pj), None)
+                homographies.matches.matches.pop((pi, pj), None)
+                if i not in active:
+                    homographies.matches.anchors.pop(pi, None)
+            for i in list(evaluated) + [j]:
+                if i not in active:
+                    homographies.images.images.pop(fpaths[i], None)
+                    homographies.features.features.pop(fpaths[i], None)
+                    thumbnails.pop(fpaths[i], None)
+    return graphs
+
+
+def stitch_chains(chains, step, frame_range_min):
+    """
+    Returns the frames selected by a serial run starting at frame_range_min.
+
+    chains: frames selected by runs started at other frames, e.g. on chunks
+        of the video; each starts with the frame the run started from
+    step(i): next frame selected after i by a serial run, or None
+
+    The selection after a frame only depends on that frame, so the serial
+    run follows the chains and continues with their transitions as soon as
+    it reaches one of their frames. step is called only where no chain
+    knows the next frame, e.g. after the last frame of a chunk if the
+    following chunk has not selected any of the same frames.
+    """
+    transitions = {}
+    for chain in chains:
+        for i, j in zip(chain[:-1], chain[1:]):
+            transitions[i] = j
+    chain = [frame_range_min]
+    while True:
+        j = transitions.get(chain[-1])
+        if j is None:
+            j = step(chain[-1])
+        if j is None:
+            return chain
+        chain.append(j)
+
+
+def graph2chain(graph, frame_range_min):
+    return [frame_range_min] + [j for i, j in graph['fpaths']]
+
+
+def chain2graph(chain, fpaths):
+    graph = {'im_matches': {}, 'fpaths': {}, 'num_evaluated': 0}
+    for i, j in zip(chain[:-1], chain[1:]):
+        graph['fpaths'][i, j] = [fpaths[i], fpaths[j]]
+    return graph
+
+
 def graph2fpaths(graph):
     fpaths = list(graph['fpaths'].values())
     first_fpath = fpaths[0][0]
@@ -231,18 +1343,52 @@ def polygon_area(x,y):
 
 
 def write_mp4(name, frames, fps=10):
+    """ Encodes the frames (any iterable of RGB images) one at a time. """
     import imageio
-    imageio.mimwrite(name + ".mp4", frames, "mp4", fps=fps)
+    with imageio.get_writer(name + ".mp4", format="mp4", fps=fps) as writer:
+        for frame in frames:
+            writer.append_data(frame)
+
+
+def iter_frames(fpaths, imreader, num_workers=4, depth=16):
+    """
+    Decodes the frames in order, with at most `depth` decoded frames
+    waiting in memory.
+    """
+    if imreader.src_type == 'video':
+        # the capture decodes one frame at a time and in order anyway
+        num_workers = 1
+    read_ahead = ReadAhead(imreader.__getitem__, fpaths, num_workers, depth)
+    try:
+        for k in fpaths:
+            yield read_ahead(k)
+    finally:
+        read_ahead.close()
 
 
-def save_as_video(dst, fpaths, imreader):
-    frames = []
-    for fp in tqdm(fpaths):
-        frames += [imreader[fp]]
-    write_mp4(dst, frames)
+def save_as_video(dst, fpaths, imreader, fps=10, num_workers=4, depth=16):
+    frames = iter_frames(fpaths, imreader, num_workers, depth)
+    write_mp4(dst, tqdm(frames, total=len(fpaths)), fps=fps)
 
 
-def extract_frames(dir_dst, fpaths, imreader):
+def extract_frames(dir_dst, fpaths, imreader, num_workers=8):
+    """
+    Copies the frames to dir_dst. Frames of a tar are read in one pass in
+    the order of the archive, frames of a video in the order of the video,
+    files of a directory are copied by a pool of threads.
+    """
+    os.makedirs(dir_dst, exist_ok=True)
+    if imreader.src_type == 'dir':
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            for _ in pool.map(lambda k: imreader.save(k, dir_dst), fpaths):
+                pass
+        return
+    if imreader.src_type == 'tar':
+        fpaths = sorted(fpaths, key=lambda k: imreader.members[k][0])
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(imreader.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    elif imreader.src_type == 'video':
+        fpaths = sorted(fpaths, key=lambda k: imreader.video.index[os.path.basename(k)])
     for k in fpaths:
         imreader.save(k, dir_dst)
 
@@ -259,38 +1405,252 @@ def tar2bytearr(tar_member):
     )
 
 import shutil
+import json
+import hashlib
 
 import tarfile
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Opens a temporary file next to path and renames it to path once it is
+    written, so that other processes never read a partial file. The filter
+    runs on its own, utils.lib.atomic_write is the pipeline's copy.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, mode) as fp:
+            yield fp
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def tar_index_paths(src):
+    # next to the tar if possible, otherwise in the user cache
+    # (e.g. for tars on read-only mounts)
+    key = hashlib.sha1(os.path.abspath(src).encode()).hexdigest()
+    cache_dir = os.path.join(
+        os.path.expanduser('~'), '.cache', 'epic_fields', 'tar_index'
+    )
+    return [src + '.index.json', os.path.join(cache_dir, key + '.json')]
+
+
+def load_tar_index(src):
+    """
+    Returns {member name: (data offset, size)} for the files in a tar.
+    The index is built with one pass over the archive and saved as a
+    sidecar, later calls only read the sidecar. It is rebuilt when the
+    size or mtime of the tar changes.
+    """
+    st = os.stat(src)
+    signature = [st.st_size, st.st_mtime_ns]
+    paths = tar_index_paths(src)
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path) as fp:
+                index = json.load(fp)
+        except (OSError, ValueError):
+            continue
+        if index.get('signature') == signature:
+            return {k: tuple(v) for k, v in index['members'].items()}
+
+    members = {}
+    with tarfile.open(src) as tar:
+        for member in tar:
+            if member.isfile():
+                members[member.name] = (member.offset_data, member.size)
+    index = {'signature': signature, 'members': members}
+    for path in paths:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with atomic_write(path) as fp:
+                json.dump(index, fp)
+            break
+        except OSError:
+            continue
+    return members
+
+
+# scale: (grey, colour) flags for reduced decoding
+REDUCED_FLAGS = {
+    2: (cv.IMREAD_REDUCED_GRAYSCALE_2, cv.IMREAD_REDUCED_COLOR_2),
+    4: (cv.IMREAD_REDUCED_GRAYSCALE_4, cv.IMREAD_REDUCED_COLOR_4),
+    8: (cv.IMREAD_REDUCED_GRAYSCALE_8, cv.IMREAD_REDUCED_COLOR_8),
+}
+
+
+def pread_all(fd, size, offset):
+    chunks = []
+    while size > 0:
+        chunk = os.pread(fd, size, offset)
+        if not chunk:
+            raise EOFError(f'Unexpected end of file at offset {offset}.')
+        chunks.append(chunk)
+        size -= len(chunk)
+        offset += len(chunk)
+    return b''.join(chunks)
+
+
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov', '.webm']
+
+
+class VideoFrames:
+    """
+    Frames of a video decoded sequentially with cv.VideoCapture, named
+    frame_%010d.jpg from 1 as the frames extracted with ffmpeg.
+
+    fps: resample to this frame rate as ffmpeg's fps filter (nearest
+        frame), None keeps every frame
+    longside: resize so that the long side has this length, None keeps the
+        size of the video
+
+    Frames are decoded in order, skipping frames with grab(). The last few
+    frames are kept for small steps back, larger steps back seek.
+
+    The frame count is the container's, which is an estimate for many. If
+    the video ends earlier, fpaths is shortened in place to the frames
+    decoded, as ffmpeg would have extracted, and the frame asked for raises
+    IndexError, see select_frames.
+    """
+    def __init__(self, src, fps=None, longside=None, num_recent=8, max_skip=300):
+        self.src = src
+        self.cap = cv.VideoCapture(src)
+        if not self.cap.isOpened():
+            raise ValueError(f'Cannot open video: {src}')
+        self.src_fps = self.cap.get(cv.CAP_PROP_FPS)
+        self.src_count = int(self.cap.get(cv.CAP_PROP_FRAME_COUNT))
+        self.fps = fps
+        self.longside = longside
+        num_frames = self.src_count
+        if fps is not None and self.src_fps > 0:
+            num_frames = int(round(self.src_count * fps / self.src_fps))
+        self.fpaths = [f'frame_{t + 1:010d}.jpg' for t in range(num_frames)]
+        self.index = {fpath: t for t, fpath in enumerate(self.fpaths)}
+        self.num_recent = num_recent
+        self.max_skip = max_skip
+        self.recent = OrderedDict()
+        # next frame of the video returned by the capture
+        self.pos = 0
+        self.lock = threading.Lock()
+
+    def source_frame(self, t):
+        if self.fps is None or self.src_fps <= 0:
+            return t
+        return min(int(round(t * self.src_fps / self.fps)), self.src_count - 1)
+
+    def truncate(self, s):
+        """ The video ends before source frame s, drops the frames from there on. """
+        num_frames = len(self.fpaths)
+        while num_frames > 0 and self.source_frame(num_frames - 1) >= s:
+            num_frames -= 1
+        del self.fpaths[num_frames:]
+
+    def resize(self, im):
+        if self.longside is None:
+            return im
+        h, w = im.shape[:2]
+        if w >= h:
+            size = (self.longside, h * self.longside // w)
+        else:
+            size = (w * self.longside // h, self.longside)
+        return cv.resize(im, dsize=size, interpolation=cv.INTER_AREA)
+
+    def __getitem__(self, k):
+        """ BGR frame named k. """
+        s = self.source_frame(self.index[os.path.basename(k)])
+        with self.lock:
+            if s in self.recent:
+                self.recent.move_to_end(s)
+                return self.recent[s]
+            if s < self.pos or s - self.pos > self.max_skip:
+                self.cap.set(cv.CAP_PROP_POS_FRAMES, s)
+                self.pos = s
+            ok = True
+            while ok and self.pos < s:
+                ok = self.cap.grab()
+                if ok:
+                    self.pos += 1
+            if ok:
+                ok, im = self.cap.read()
+            if not ok:
+                self.truncate(self.pos)
+                raise IndexError(f'{self.src} ends at frame {self.pos}')
+            self.pos += 1
+            im = self.resize(im)
+            self.recent[s] = im
+            if len(self.recent) > self.num_recent:
+                self.recent.popitem(last=False)
+        return im
+
+    def close(self):
+        self.cap.release()
+
+
 class ImageReader:
-    def __init__(self, src, scale=1, cv_flag=cv.IMREAD_UNCHANGED):
-        # src can be directory or tar file
+    def __init__(self, src, scale=1, cv_flag=cv.IMREAD_UNCHANGED, fps=None, longside=None,
+                 frames=None):
+        # src can be directory, tar file or video, fps and longside only
+        # apply to videos, see VideoFrames. frames: names of the JPEGs of a
+        # directory if the caller listed it already, e.g. from a manifest
 
-        self.scale = 1
+        self.scale = scale
         self.cv_flag = cv_flag
+        # JPEGs are downscaled by 2, 4 or 8 while decoding (DCT scaling in
+        # libjpeg), other scales are resized after decoding
+        self.decode_flag = cv_flag
+        self.resize = scale != 1 and scale not in REDUCED_FLAGS
+        if scale in REDUCED_FLAGS:
+            grey = cv_flag == cv.IMREAD_GRAYSCALE
+            self.decode_flag = REDUCED_FLAGS[scale][0 if grey else 1]
+        self.fd = None
+        self.video = None
 
         if os.path.isdir(src):
             self.src_type = 'dir'
-            self.fpaths = sorted(glob(os.path.join(src, '*.jpg')))
+            if frames is None:
+                frames = [os.path.basename(x) for x in glob(os.path.join(src, '*.jpg'))]
+            self.fpaths = sorted(os.path.join(src, x) for x in frames)
         elif os.path.isfile(src) and os.path.splitext(src)[1] == '.tar':
-            self.tar = tarfile.open(src)
+            # members are read with pread, so the reader can be used from
+            # several threads or forked processes at once
+            self.members = load_tar_index(src)
+            self.fd = os.open(src, os.O_RDONLY)
             self.src_type = 'tar'
-            self.fpaths = sorted([x for x in self.tar.getnames() if 'frame_' in x and '.jpg' in x])
+            self.fpaths = sorted([x for x in self.members if 'frame_' in x and '.jpg' in x])
+        elif os.path.isfile(src) and os.path.splitext(src)[1].lower() in VIDEO_EXTENSIONS:
+            self.video = VideoFrames(src, fps=fps, longside=longside)
+            self.src_type = 'video'
+            self.fpaths = self.video.fpaths
+            self.resize = scale != 1
         else:
             print('Source has unknown format.')
             exit()
 
+    def read_bytes(self, k):
+        offset, size = self.members[k]
+        return pread_all(self.fd, size, offset)
+
     def __getitem__(self, k):
         if self.src_type == 'dir':
 
-            im = cv.imread(k, self.cv_flag)
+            im = cv.imread(k, self.decode_flag)
         elif self.src_type == 'tar':
-            member = self.tar.getmember(k)
-            tarfile = self.tar.extractfile(member)
-            byte_array = tar2bytearr(tarfile)
-            im = cv.imdecode(byte_array, self.cv_flag)
-        if self.scale != 1:
+            byte_array = np.frombuffer(self.read_bytes(k), dtype=np.uint8)
+            im = cv.imdecode(byte_array, self.decode_flag)
+        elif self.src_type == 'video':
+            im = self.video[k]
+            if self.cv_flag == cv.IMREAD_GRAYSCALE:
+                im = cv.cvtColor(im, cv.COLOR_BGR2GRAY)
+        if self.resize:
             im = cv.resize(
-                im, dsize=[im.shape[0] // self.scale, im.shape[1] // self.scale]
+                im,
+                dsize=[im.shape[1] // self.scale, im.shape[0] // self.scale],
+                interpolation=cv.INTER_AREA,
             )
         if self.cv_flag != cv.IMREAD_GRAYSCALE:
             im = im[..., [2, 1, 0]]
@@ -301,7 +1661,26 @@ class ImageReader:
         if self.src_type == 'dir':
             shutil.copy(k, os.path.join(dst, fn))
         elif self.src_type == 'tar':
-            self.tar.extract(self.tar.getmember(k), dst)
+            # same layout as TarFile.extract
+            fpath = os.path.join(dst, k)
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            with open(fpath, 'wb') as fp:
+                fp.write(self.read_bytes(k))
+        elif self.src_type == 'video':
+            # only the frames saved are ever encoded
+            os.makedirs(dst, exist_ok=True)
+            cv.imwrite(os.path.join(dst, fn), self.video[k], [cv.IMWRITE_JPEG_QUALITY, 95])
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.video is not None:
+            self.video.close()
+            self.video = None
+
+    def __del__(self):
+        self.close()
 
 
 # test
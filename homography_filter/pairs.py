@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+
+from lib import homography_overlap, find_next_frame
+
+
+class EvaluatedPairs:
+    """
+    Records the pairs evaluated by calc_graph: frame indices (i, j), the
+    homography mapping frame i to frame j, the number of RANSAC inliers
+    and the overlap. Saved as a .npz with the arrays
+
+        pairs           int32 (N, 2)
+        homographies    float32 (N, 3, 3), NaN if none was found
+        inliers         int32 (N,), -1 for pairs decided by Prescreen (the
+                        homography is then its estimated similarity)
+        overlaps        float32 (N,)
+        fpaths          str (F,), frame basenames
+        im_size         int32 (2,), height and width at full resolution
+
+    Set as the `pairs` attribute of a Homographies (or KLTHomographies).
+    """
+    def __init__(self, fpaths):
+        self.fpaths = fpaths
+        self.index = {fpath: i for i, fpath in enumerate(fpaths)}
+        self.im_size = None
+        self.rows = []
+
+    def add(self, k, M, inliers, overlap):
+        self.rows.append((self.index[k[0]], self.index[k[1]], M, inliers, overlap))
+
+    def arrays(self):
+        # pairs evaluated twice (e.g. by overlapping chunks) are kept once
+        rows = list({(i, j): (i, j, M, n, o) for i, j, M, n, o in reversed(self.rows)}.values())
+        rows.sort(key=lambda row: row[:2])
+        homographies = np.full([len(rows), 3, 3], np.nan, dtype=np.float32)
+        for r, (_, _, M, _, _) in enumerate(rows):
+            if M is not None:
+                homographies[r] = M
+        return {
+            'pairs': np.int32([row[:2] for row in rows]).reshape(-1, 2),
+            'homographies': homographies,
+            'inliers': np.int32([row[3] for row in rows]),
+            'overlaps': np.float32([row[4] for row in rows]),
+            'fpaths': np.array([os.path.basename(x) for x in self.fpaths]),
+            'im_size': np.int32(self.im_size if self.im_size is not None else [0, 0]),
+        }
+
+    def extend(self, arrays):
+        """ Adds the pairs of arrays(), e.g. of another process. """
+        for (i, j), M, inliers, overlap in zip(
+            arrays['pairs'], arrays['homographies'], arrays['inliers'], arrays['overlaps']
+        ):
+            M = None if np.isnan(M).any() else M
+            self.rows.append((int(i), int(j), M, int(inliers), float(overlap)))
+        if self.im_size is None and arrays['im_size'].any():
+            self.im_size = tuple(arrays['im_size'].tolist())
+
+    def save(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        np.savez(path, **self.arrays())
+
+
+def pairs_path(dst_file):
+    return os.path.splitext(dst_file)[0] + '.pairs.npz'
+
+
+class PairTable:
+    """
+    Evaluated pairs loaded from a file written by EvaluatedPairs.save.
+
+    overlap(i, j) returns the recorded overlap of a pair. Other pairs are
+    estimated by chaining homographies: every frame evaluated against an
+    anchor gets the homography to the first frame through the anchors
+    before it. Errors accumulate along the chain, estimates of frames far
+    apart are less accurate than recorded overlaps.
+    """
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.pairs = data['pairs']
+            self.homographies = data['homographies'].astype(np.float64)
+            self.inliers = data['inliers']
+            self.overlaps = data['overlaps']
+            self.fpaths = data['fpaths'].tolist()
+            self.im_size = tuple(data['im_size'].tolist())
+        self.lookup = {
+            (i, j): r for r, (i, j) in enumerate(self.pairs.tolist())
+        }
+        # frames the engine evaluated
+        self.frames = np.unique(self.pairs).tolist()
+        self._poses = None
+
+    @property
+    def poses(self):
+        """ frame -> (component, homography from the frame to its first frame) """
+        if self._poses is None:
+            poses = {}
+            for r, (i, j) in enumerate(self.pairs.tolist()):
+                if i not in poses:
+                    # first frame of a new connected component
+                    poses[i] = (i, np.eye(3))
+                M = self.homographies[r]
+                if j not in poses and not np.isnan(M).any():
+                    component, G = poses[i]
+                    # x_j = M x_i
+                    poses[j] = (component, G @ np.linalg.inv(M))
+            self._poses = poses
+        return self._poses
+
+    def overlap(self, i, j):
+        r = self.lookup.get((i, j))
+        if r is not None:
+            return float(self.overlaps[r])
+        if i not in self.poses or j not in self.poses:
+            # no homography found, as the engine would return
+            return 0
+        (ci, Gi), (cj, Gj) = self.poses[i], self.poses[j]
+        if ci != cj:
+            return 0
+        return homography_overlap(np.linalg.solve(Gj, Gi), self.im_size)
+
+
+def reselect(table, overlap, frame_range_min=0, frame_range_max=None, search='linear'):
+    """
+    Selected frames (indices) for another threshold from a PairTable,
+    without decoding any frame. Only frames evaluated by the original run
+    are candidates, with the threshold of the original run the selection
+    is the same.
+    """
+    frames = [
+        x for x in table.frames
+        if x >= frame_range_min and (frame_range_max is None or x < frame_range_max)
+    ]
+    if not frames:
+        return []
+    chain = [0]
+    while True:
+        i = chain[-1]
+        j = find_next_frame(
+            lambda j: table.overlap(frames[i], frames[j]), i, len(frames), overlap, search
+        )
+        if j is None:
+            return [frames[x] for x in chain]
+        chain.append(j)
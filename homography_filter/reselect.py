@@ -0,0 +1,36 @@
+"""
+Selects frames for other overlap thresholds from the pairs saved by
+filter.py --save_pairs, without decoding any frame.
+
+    python reselect.py --pairs selected.pairs.npz --overlap 0.8 0.95 \
+        --dst_file selected.txt
+"""
+import argparse
+
+from pairs import PairTable, reselect
+from filter import dst_file_for, write_selected_frames
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", required=True, type=str,
+                        help="<dst_file without extension>.pairs.npz of filter.py")
+    parser.add_argument("--overlap", default=[0.9], type=float, nargs='+')
+    parser.add_argument("--dst_file", required=True, type=str)
+    parser.add_argument("--frame_range_min", default=0, type=int)
+    parser.add_argument("--frame_range_max", default=None, type=int)
+    parser.add_argument("--search", default='linear', choices=['linear', 'gallop'])
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    table = PairTable(args.pairs)
+    print(f'Loaded {len(table.pairs)} pairs of {len(table.frames)} frames.')
+    for overlap in args.overlap:
+        selected = reselect(
+            table, overlap, args.frame_range_min, args.frame_range_max, args.search
+        )
+        dst_file = dst_file_for(args.dst_file, overlap, args.overlap)
+        write_selected_frames(dst_file, [table.fpaths[x] for x in selected])
+        print(f'{overlap}: {len(selected)} frames selected.')
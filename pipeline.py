@@ -0,0 +1,164 @@
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+from utils.lib import *
+from utils.manifest import Manifest
+from utils.scheduler import Scheduler, add_scheduler_args, make_slots
+from select_sparse_frames import filter_video, init_worker
+from reconstruct_sparse import MAX_SPARSE_FRAMES, sparse_done, sparse_job, report_sparse
+from register_dense import dense_done, dense_job, report_dense
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Frame selection, sparse reconstruction and dense registration of each '
+                    'video, a video enters the next stage as soon as it leaves the previous one. '
+                    'Dense registration jobs get free slots before sparse reconstruction jobs.')
+    parser.add_argument('--input_videos', type=str, default='input_videos.txt',
+                        help='A file with list of vidoes to be processed in all stages')
+    parser.add_argument('--epic_kithens_root', type=str, default='.',
+                        help='Path to epic kitchens images.')
+    parser.add_argument('--sampled_images_path', type=str, default='sampled_frames',
+                        help='Path to the directory containing sampled image files.')
+    parser.add_argument('--homography_overlap', type=float, default=0.9,
+                        help='Threshold of the homography to sample new frames, higher value samples more images.')
+    parser.add_argument('--sparse_reconstuctions_root', type=str, default='colmap_models/sparse',
+                        help='Path to the sparsely reconstructed models.')
+    parser.add_argument('--dense_reconstuctions_root', type=str, default='colmap_models/dense',
+                        help='Path to the densely registered models.')
+    parser.add_argument('--logs_path', type=str, default='logs',
+                        help='Path to store the log and summary files, in <stage>/out_logs_terminal '
+                             'and <stage>/out_summary.')
+    parser.add_argument('--gpu_index', type=int, default=0,
+                        help='Index of the GPU to use.')
+    parser.add_argument('--filter_workers', type=int, default=4,
+                        help='Videos filtered at once.')
+    parser.add_argument('--opencv_threads', type=int, default=None,
+                        help='OpenCV threads of each filter process, by default the CPUs divided by '
+                             '--filter_workers')
+    add_scheduler_args(parser)
+    parser.add_argument('--max_concurrent_dense', type=int, default=None,
+                        help='Videos in dense registration at once, by default the number of slots.')
+    return parser.parse_args()
+
+
+def stage_args(args, stage):
+    # reconstruct_sparse.py / register_dense.py arguments of a stage
+    return argparse.Namespace(**dict(
+        vars(args),
+        logs_path=os.path.join(args.logs_path, stage, 'out_logs_terminal'),
+        summary_path=os.path.join(args.logs_path, stage, 'out_summary'),
+    ))
+
+
+def selected_frames_path(args, video):
+    return os.path.join(args.sampled_images_path, '%s_selected_frames.txt' % video)
+
+
+def main():
+    args = parse_args()
+    gpu_indices = args.gpu_indices or [args.gpu_index]
+    sparse_args = stage_args(args, 'sparse')
+    dense_args = stage_args(args, 'dense')
+    for x in [sparse_args, dense_args]:
+        os.makedirs(x.logs_path, exist_ok=True)
+        os.makedirs(x.summary_path, exist_ok=True)
+    os.makedirs(args.sparse_reconstuctions_root, exist_ok=True)
+    os.makedirs(args.dense_reconstuctions_root, exist_ok=True)
+
+    videos = sorted(set(read_lines_from_file(args.input_videos)))
+    manifest = Manifest(args.epic_kithens_root, videos=videos)
+    missing = [x for x in videos if x not in manifest.videos]
+    for video in missing:
+        print(f'{video} not found in {args.epic_kithens_root}')
+    videos = [x for x in videos if x in manifest.videos]
+
+    opencv_threads = args.opencv_threads
+    if opencv_threads is None:
+        opencv_threads = max(1, (os.cpu_count() or 1) // args.filter_workers)
+    # spawn, the parent runs the scheduler threads meanwhile
+    filter_pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.filter_workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker, initargs=(opencv_threads,),
+    )
+    # the stages share the CPU and GPU slots. Jobs are ranked by their
+    # frames, which for registration are all frames of the video, so dense
+    # jobs get free slots before sparse ones: the longest work does not
+    # start last and videos leave the pipeline early
+    slots = make_slots(args.cpu_slots, gpu_indices, args.gpu_slots)
+    sparse_pool = Scheduler(slots, args.max_concurrent)
+    dense_pool = Scheduler(slots, args.max_concurrent_dense)
+
+    pending = {}  # future -> (stage, video)
+    num_selected = {}
+    failed = []
+
+    def submit_filter(video):
+        filter_argv = [
+            '--src', manifest.folder(video), '--dst_file', selected_frames_path(args, video),
+            '--overlap', str(args.homography_overlap),
+        ]
+        pending[filter_pool.submit(
+            filter_video, video, filter_argv, manifest.frame_names(video)
+        )] = ('filter', video)
+
+    def submit_sparse(video):
+        with open(selected_frames_path(args, video)) as fp:
+            num_selected[video] = len(fp.readlines())
+        if num_selected[video] >= MAX_SPARSE_FRAMES:
+            print(f'{video}: {num_selected[video]} selected frames, too many to reconstruct')
+            failed.append(('sparse', video))
+            return
+        job = sparse_job(video, num_selected[video], sparse_args)
+        pending[sparse_pool.submit(job)] = ('sparse', video)
+
+    def submit_dense(video):
+        job = dense_job(video, manifest.num_frames(video), dense_args)
+        pending[dense_pool.submit(job)] = ('dense', video)
+
+    # resume from the outputs of earlier runs, longest videos first
+    for video in sorted(videos, key=lambda x: -manifest.num_frames(x)):
+        if dense_done(args.dense_reconstuctions_root, video):
+            print(f'{video}: done')
+        elif sparse_done(args.sparse_reconstuctions_root, video):
+            submit_dense(video)
+        elif os.path.isfile(selected_frames_path(args, video)):
+            submit_sparse(video)
+        else:
+            submit_filter(video)
+
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            stage, video = pending.pop(future)
+            result = future.result()
+            if stage == 'filter':
+                if 'error' in result:
+                    print(f"Error occurred in {video}:\n{result['error']}")
+                    failed.append((stage, video))
+                    continue
+                print(f"{video}: selected {result['num_selected'][args.homography_overlap]} "
+                      f"of {result['num_frames']} frames in {result['runtime']:.1f}s")
+                submit_sparse(video)
+            elif stage == 'sparse':
+                report_sparse(result, num_selected[video])
+                if result['error'] is not None or not result['finish'] > 0:
+                    failed.append((stage, video))
+                    continue
+                submit_dense(video)
+            else:
+                report_dense(result, manifest.num_frames(video))
+                if result['error'] is not None or not result['finish'] > 0:
+                    failed.append((stage, video))
+
+    filter_pool.shutdown()
+    sparse_pool.shutdown()
+    dense_pool.shutdown()
+    for stage, video in failed:
+        print(f'{video} failed in the {stage} stage')
+    print(f'{len(videos) - len(failed)} of {len(videos)} videos done.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,10 @@
-import subprocess
 import shutil
 import os
 import time
-import glob
 import argparse
-import pycolmap
 from utils.lib import *
+from utils.manifest import Manifest
+from utils.scheduler import Job, Phase, add_scheduler_args, colmap_binary, run_jobs
 # Function to parse command-line arguments
 def parse_args():
     parser = argparse.ArgumentParser(description='COLMAP Reconstruction Script')
@@ -23,73 +22,114 @@ def parse_args():
                         help='Path to store the summary files.')
     parser.add_argument('--gpu_index', type=int, default=0,
                         help='Index of the GPU to use.')
+    add_scheduler_args(parser)
 
     return parser.parse_args()
 
 
-args = parse_args()
+def dense_done(dense_root, video):
+    return os.path.isfile(os.path.join(dense_root, video, 'images.bin'))
 
-gpu_index = args.gpu_index
 
-videos_list = read_lines_from_file(args.input_videos)
-videos_list = sorted(videos_list)
-print('GPU: %d' % (gpu_index))
-os.makedirs(args.logs_path, exist_ok=True)
-os.makedirs(args.summary_path, exist_ok=True)
-os.makedirs(args.sparse_reconstuctions_root, exist_ok=True)
-os.makedirs(args.dense_reconstuctions_root, exist_ok=True)
-
-
-i = 0
-for video in videos_list:
+def dense_job(video, num_lines, args, cost=None):
+    """
+    COLMAP feature extraction and sequential matching of all frames on a
+    GPU slot, then registration into the sparse model on a CPU slot. Runs
+    in <dense_root>/<video>/ with a copy of the sparse database, which is
+    removed at the end since it's too large.
+    """
     pre = video.split('_')[0]
-    if (not os.path.exists(os.path.join(args.dense_reconstuctions_root, '%s' % video))):
+    colmap = colmap_binary()
+    workdir = os.path.abspath(os.path.join(args.dense_reconstuctions_root, video))
+    sparse_dir = os.path.abspath(os.path.join(args.sparse_reconstuctions_root, video))
+    image_path = os.path.abspath(os.path.join(args.epic_kithens_root, pre, video))
+    vocab_tree_path = os.path.abspath(args.vocab_tree_path)
+    summary_file = os.path.abspath(os.path.join(args.summary_path, '%s.out' % video))
+    log_path = os.path.join(args.logs_path, '%s_%d_register_dense.out' % (video, os.getpid()))
+    phases = [
+        Phase('feature_extractor', 'gpu', lambda gpu: [
+            colmap, 'feature_extractor',
+            '--database_path', 'database.db',
+            '--ImageReader.camera_model', 'OPENCV',
+            '--ImageReader.single_camera', '1',
+            '--ImageReader.existing_camera_id', '1',
+            '--SiftExtraction.use_gpu', '1',
+            '--SiftExtraction.gpu_index', str(gpu),
+            '--image_path', image_path,
+        ]),
+        Phase('sequential_matcher', 'gpu', lambda gpu: [
+            colmap, 'sequential_matcher',
+            '--database_path', 'database.db',
+            '--SiftMatching.use_gpu', '1',
+            '--SequentialMatching.loop_detection', '1',
+            '--SiftMatching.gpu_index', str(gpu),
+            '--SequentialMatching.vocab_tree_path', vocab_tree_path,
+        ]),
+        Phase('image_registrator', 'cpu', lambda _: [
+            colmap, 'image_registrator',
+            '--database_path', 'database.db',
+            '--input_path', os.path.join(sparse_dir, 'sparse', '0'),
+            '--output_path', workdir,
+        ]),
+        Phase('model_analyzer', 'cpu', lambda _: [
+            colmap, 'model_analyzer', '--path', workdir,
+        ], stdout_path=summary_file),
+    ]
+
+    start_time = []
+
+    def setup():
+        start_time.append(time.time())
+        #copy the database from the sparse model
+        shutil.copy(os.path.join(sparse_dir, 'database.db'), os.path.join(workdir, 'database.db'))
+
+    def finish():
+        with open(summary_file, 'a') as fp:
+            fp.write('%d minutes (registration time)\n' % ((time.time() - start_time[0]) // 60))
+        os.remove(os.path.join(workdir, 'database.db'))
+        return get_num_images(workdir)
+
+    return Job(video, workdir, phases, num_lines if cost is None else cost, log_path,
+               setup=setup, finish=finish)
+
+
+def report_dense(result, num_lines):
+    print('Finished: ', result['video'], '(', num_lines, 'images )')
+    if result['error'] is None and result['finish'] > 0:
+        reg_images = result['finish']
+        print(f"Registered_images/total_images: {reg_images}/{num_lines} = {round(reg_images/max(num_lines, 1)*100)}%")
+    else:
+        print('The video reconstruction fails!! no colmap files are found!')
+    print("Execution time:  %s minutes" % round(result['runtime']/60, 0))
+    print('-----------------------------------------------------------')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    gpu_indices = args.gpu_indices or [args.gpu_index]
+
+    videos_list = read_lines_from_file(args.input_videos)
+    videos_list = sorted(videos_list)
+    print('GPU: %s' % (', '.join(str(x) for x in gpu_indices)))
+    os.makedirs(args.logs_path, exist_ok=True)
+    os.makedirs(args.summary_path, exist_ok=True)
+    os.makedirs(args.sparse_reconstuctions_root, exist_ok=True)
+    os.makedirs(args.dense_reconstuctions_root, exist_ok=True)
+    manifest = Manifest(args.epic_kithens_root, videos=videos_list)
+
+    jobs = []
+    num_lines = {}
+    for video in videos_list:
+        if dense_done(args.dense_reconstuctions_root, video):
+            continue
         # check the number of images in this video
-        num_lines = len(glob.glob(os.path.join(args.epic_kithens_root,pre,video,'*.jpg')))
-
-        print('Processing: ', video, '(',num_lines, 'images )')
-        start_time = time.time()
-
-        # Define the path to the shell script
-        script_path = 'scripts/register_dense.sh'
-
-        # Create a unique copy of the script
-        script_copy_path = video + '_' + str(os.getpid()) + '_' + os.path.basename(script_path)
-        shutil.copy(script_path, script_copy_path)
-
-        # Output file
-        output_file_path = os.path.join(args.logs_path, script_copy_path.replace('.sh', '.out'))
-
-
-        # Define the command to execute the script
-        command = ["bash", script_copy_path, video,args.sparse_reconstuctions_root,args.dense_reconstuctions_root,args.epic_kithens_root,args.summary_path,str(gpu_index)]
-        # Open the output file in write mode
-        with open(output_file_path, 'w') as output_file:
-            # Run the command and capture its output in real time
-            process = subprocess.Popen(command, stdout=output_file, stderr=subprocess.PIPE, text=True)
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    output_file.write(output)
-                    output_file.flush()
-
-        # Once the script has finished running, you can delete the copy of the script
-        os.remove(script_copy_path)
-
-
-        reg_images = get_num_images(os.path.join(args.dense_reconstuctions_root,video))
-        if reg_images > 0:
-            print(f"Registered_images/total_images: {reg_images}/{num_lines} = {round(reg_images/num_lines*100)}%")
-        else:
-            print('The video reconstruction fails!! no colmap files are found!')
-
-
-
-
-        print("Execution time:  %s minutes" % round((time.time() - start_time)/60, 0))
-        print('-----------------------------------------------------------')
-
-    i += 1
-
+        num_lines[video] = manifest.num_frames(video) if video in manifest.videos else 0
+        print('Queued: ', video, '(', num_lines[video], 'images )')
+        jobs.append(dense_job(video, num_lines[video], args))
+
+    run_jobs(
+        jobs, cpu_slots=args.cpu_slots, gpu_indices=gpu_indices, gpu_slots=args.gpu_slots,
+        max_concurrent=args.max_concurrent,
+        callback=lambda result: report_dense(result, num_lines[result['video']]),
+    )
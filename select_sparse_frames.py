@@ -1,9 +1,14 @@
-import subprocess
 import concurrent.futures
-import glob
 import os
+import sys
+import time
+import traceback
 import argparse
 from utils.lib import *
+from utils.manifest import Manifest
+
+# filter.py and its modules import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'homography_filter'))
 # Function to parse command-line arguments
 def parse_args():
     parser = argparse.ArgumentParser(description='COLMAP Reconstruction Script')
@@ -13,13 +18,44 @@ def parse_args():
                         help='Path to epic kitchens images.')
     parser.add_argument('--sampled_images_path', type=str, default='sampled_frames',
                         help='Path to the directory containing sampled image files.')
-    parser.add_argument('--homography_overlap', type=float, default=0.9,
-                        help='Threshold of the homography to sample new frames, higher value samples more images')
+    parser.add_argument('--homography_overlap', type=float, nargs='+', default=[0.9],
+                        help='Threshold of the homography to sample new frames, higher value samples more images. '
+                             'With several values, all are computed in one pass and written to '
+                             '<sampled_images_path>/overlap_<value>/')
     parser.add_argument('--max_concurrent', type=int, default=8,
                         help='Max number of concurrent processes')
+    parser.add_argument('--opencv_threads', type=int, default=None,
+                        help='OpenCV threads of each process, by default the CPUs divided by '
+                             '--max_concurrent')
     return parser.parse_args()
 
 
+def init_worker(opencv_threads):
+    import cv2
+    # one video per process, OpenCV's own threads would oversubscribe the CPUs
+    cv2.setNumThreads(opencv_threads)
+
+
+def filter_video(video, filter_argv, frames=None):
+    """
+    Runs in a worker process, returns the result of filter.run_filter.
+    frames: names of the frames of the video from the manifest, so that the
+    filter does not list the directory again.
+    """
+    from argparser import parse_args as parse_filter_args
+    from filter import run_filter
+    t0 = time.perf_counter()
+    try:
+        filter_args = parse_filter_args(filter_argv)
+        filter_args.frames = frames
+        result = run_filter(filter_args)
+    except (Exception, SystemExit):
+        # ImageReader exits on sources of unknown format
+        return {'video': video, 'error': traceback.format_exc(),
+                'runtime': time.perf_counter() - t0}
+    return dict(result, video=video)
+
+
 
 
 def main():
@@ -27,37 +63,48 @@ def main():
 
     videos = read_lines_from_file(args.input_videos)
     epic_root = args.epic_kithens_root
+    manifest = Manifest(epic_root, videos=videos)
     params_list = []
     for video in videos:
-        video_pre = video.split('_')[0]
-        for folder in sorted(glob.glob(os.path.join(epic_root,video_pre+'/*'))):
-            video = folder.split('/')[-1] 
-            if video in videos:
-                print(video)
-                added_run = ['--src', folder, '--dst_file', '%s/%s_selected_frames.txt'%(args.sampled_images_path,video), '--overlap', str(args.homography_overlap)]
-                if not added_run  in params_list:
-                                params_list.append(added_run)
-                    
+        if video not in manifest.videos:
+            print(f'{video} not found in {epic_root}')
+            continue
+        if any(x[0] == video for x in params_list):
+            continue
+        print(video)
+        added_run = ['--src', manifest.folder(video), '--dst_file', '%s/%s_selected_frames.txt'%(args.sampled_images_path,video), '--overlap'] + [str(x) for x in args.homography_overlap]
+        params_list.append((video, manifest.num_frames(video), added_run, manifest.frame_names(video)))
+
     if params_list:
         max_concurrent = args.max_concurrent
-        # Create a process pool executor with a maximum of K processes
-        executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_concurrent)
+        opencv_threads = args.opencv_threads
+        if opencv_threads is None:
+            opencv_threads = max(1, (os.cpu_count() or 1) // max_concurrent)
+        # longest videos first, so that no long video starts last
+        params_list.sort(key=lambda x: -x[1])
 
-        # Submit the tasks to the executor
         results = []
-        for i in range(len(params_list)):
-            future = executor.submit(run_script, 'homography_filter/filter.py', params_list[i % len(params_list)])
-            results.append(future)
-
-        # Wait for all tasks to complete
-        for r in concurrent.futures.as_completed(results):
-            try:
-                r.result()
-            except Exception as e:
-                print(f"Error occurred: {e}")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_concurrent, initializer=init_worker, initargs=(opencv_threads,)
+        ) as executor:
+            futures = [
+                executor.submit(filter_video, video, filter_argv, frames)
+                for video, _, filter_argv, frames in params_list
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if 'error' in result:
+                    print(f"Error occurred in {result['video']}:\n{result['error']}")
+                    continue
+                selected = ', '.join(
+                    f'{n} at {overlap}' for overlap, n in result['num_selected'].items()
+                )
+                print(f"{result['video']}: {result['num_frames']} frames, selected {selected} "
+                      f"in {result['runtime']:.1f}s")
 
-        # Shut down the executor
-        executor.shutdown()
+        num_failed = sum('error' in x for x in results)
+        print(f'{len(results) - num_failed} videos filtered, {num_failed} failed.')
 
 
 if __name__ == '__main__':
@@ -28,8 +28,8 @@ if __name__ == "__main__":
     if args.pcd_path is not None:
         pcd = o3d.io.read_point_cloud(args.pcd_path)
     else:
-        pcd_np = np.asarray([v.xyz for v in mod.points.values()])
-        pcd_rgb = np.asarray([v.rgb / 255 for v in mod.points.values()])
+        pcd_np = mod.points.xyz
+        pcd_rgb = mod.points.rgb / 255
         # Remove too far points from GUI -- usually noise
         pcd_np_center = np.mean(pcd_np, axis=0)
         pcd_ind = np.linalg.norm(pcd_np - pcd_np_center, axis=1) < 500
@@ -2,7 +2,7 @@ from typing import List
 import json
 from functools import cached_property
 from utils.colmap_utils import (
-    read_cameras_binary, read_points3d_binary,
+    read_cameras_binary, read_points3d_binary_columnar,
     read_images_binary, BaseImage)
 from utils.colmap_utils import Image as ColmapImage
 
@@ -24,8 +24,9 @@ class ColmapModel:
         if len(cameras) != 1:
             print("Found more than one camera!")
         self.camera = cameras[1]
+        # PointColumns, arrays in .xyz / .rgb and a {id: Point3D} mapping
         self.points = _as_list(
-            f'{model_dir}/points3D.bin', read_points3d_binary)
+            f'{model_dir}/points3D.bin', read_points3d_binary_columnar)
         self.images = _as_list(
             f'{model_dir}/images.bin', read_images_binary)
 
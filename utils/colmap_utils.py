@@ -32,6 +32,8 @@
 import os
 import sys
 import collections
+import collections.abc
+import mmap
 import numpy as np
 import struct
 
@@ -45,6 +47,23 @@ BaseImage = collections.namedtuple(
 Point3D = collections.namedtuple(
     "Point3D", ["id", "xyz", "rgb", "error", "image_ids", "point2D_idxs"])
 
+# images of a model as arrays, the 2D points of image k are
+# xys[offsets[k]:offsets[k + 1]] and point3D_ids[offsets[k]:offsets[k + 1]]
+ImageColumns = collections.namedtuple(
+    "ImageColumns", ["ids", "qvecs", "tvecs", "camera_ids", "names",
+                     "xys", "point3D_ids", "offsets"])
+
+# records of images.bin, packed little-endian as written by COLMAP
+IMAGE_HEADER_DTYPE = np.dtype([
+    ("id", "<i4"), ("qvec", "<f8", 4), ("tvec", "<f8", 3), ("camera_id", "<i4")])
+POINT2D_DTYPE = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
+
+# records of points3D.bin: id, xyz, rgb, error, then the track length
+POINT3D_HEADER_DTYPE = np.dtype([
+    ("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3), ("error", "<f8"),
+    ("track_length", "<u8")])
+TRACK_ELEM_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
 class Image(BaseImage):
     def qvec2rotmat(self):
         return qvec2rotmat(self.qvec)
@@ -111,26 +130,26 @@ def read_cameras_binary(path_to_model_file):
         void Reconstruction::WriteCamerasBinary(const std::string& path)
         void Reconstruction::ReadCamerasBinary(const std::string& path)
     """
+    with open(path_to_model_file, "rb") as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return _decode_cameras_binary(buf)
+
+
+def _decode_cameras_binary(buf):
     cameras = {}
-    with open(path_to_model_file, "rb") as fid:
-        num_cameras = read_next_bytes(fid, 8, "Q")[0]
-        for camera_line_index in range(num_cameras):
-            camera_properties = read_next_bytes(
-                fid, num_bytes=24, format_char_sequence="iiQQ")
-            camera_id = camera_properties[0]
-            model_id = camera_properties[1]
-            model_name = CAMERA_MODEL_IDS[camera_properties[1]].model_name
-            width = camera_properties[2]
-            height = camera_properties[3]
-            num_params = CAMERA_MODEL_IDS[model_id].num_params
-            params = read_next_bytes(fid, num_bytes=8*num_params,
-                                     format_char_sequence="d"*num_params)
-            cameras[camera_id] = Camera(id=camera_id,
-                                        model=model_name,
-                                        width=width,
-                                        height=height,
-                                        params=np.array(params))
-        assert len(cameras) == num_cameras
+    num_cameras = struct.unpack_from("<Q", buf, 0)[0]
+    offset = 8
+    for _ in range(num_cameras):
+        camera_id, model_id, width, height = struct.unpack_from("<iiQQ", buf, offset)
+        num_params = CAMERA_MODEL_IDS[model_id].num_params
+        params = np.frombuffer(buf, dtype="<f8", count=num_params, offset=offset + 24)
+        cameras[camera_id] = Camera(id=camera_id,
+                                    model=CAMERA_MODEL_IDS[model_id].model_name,
+                                    width=width,
+                                    height=height,
+                                    params=params.astype(np.float64))
+        offset += 24 + 8 * num_params
+    assert len(cameras) == num_cameras
     return cameras
 
 
@@ -165,38 +184,64 @@ def read_images_text(path):
     return images
 
 
-def read_images_binary(path_to_model_file):
+def read_images_binary(path_to_model_file, columnar=False):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
+
+    The file is memory-mapped. Only the offsets of the records are found
+    one image at a time (names have variable length), the fixed-size parts
+    and the 2D points are decoded with numpy. Returns {image_id: Image}, or
+    an ImageColumns if columnar.
     """
+    with open(path_to_model_file, "rb") as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return _decode_images_binary(buf, columnar)
+
+
+def _scan_images_binary(buf):
+    """ Headers, offsets and numbers of 2D points, names. """
+    num_reg_images = struct.unpack_from("<Q", buf, 0)[0]
+    headers = []
+    points_offsets = np.empty(num_reg_images, dtype=np.int64)
+    num_points2D = np.empty(num_reg_images, dtype=np.int64)
+    names = []
+    offset = 8
+    for k in range(num_reg_images):
+        headers.append(buf[offset:offset + IMAGE_HEADER_DTYPE.itemsize])
+        end = buf.find(b"\x00", offset + IMAGE_HEADER_DTYPE.itemsize)
+        names.append(buf[offset + IMAGE_HEADER_DTYPE.itemsize:end].decode("utf-8"))
+        num_points2D[k] = struct.unpack_from("<Q", buf, end + 1)[0]
+        points_offsets[k] = end + 9
+        offset = end + 9 + POINT2D_DTYPE.itemsize * int(num_points2D[k])
+    headers = np.frombuffer(b"".join(headers), dtype=IMAGE_HEADER_DTYPE)
+    return headers, points_offsets, num_points2D, names
+
+
+def _decode_images_binary(buf, columnar):
+    # every array returned is a copy, the mmap is closed afterwards
+    headers, points_offsets, num_points2D, names = _scan_images_binary(buf)
+    blocks = [
+        np.frombuffer(buf, dtype=POINT2D_DTYPE, count=n, offset=offset)
+        for offset, n in zip(points_offsets.tolist(), num_points2D.tolist())
+    ]
+    if columnar:
+        points = np.concatenate(blocks) if blocks else np.empty(0, dtype=POINT2D_DTYPE)
+        return ImageColumns(
+            ids=headers["id"].astype(np.int64), qvecs=headers["qvec"].copy(),
+            tvecs=headers["tvec"].copy(), camera_ids=headers["camera_id"].astype(np.int64),
+            names=names, xys=points["xy"].copy(),
+            point3D_ids=points["point3D_id"].copy(),
+            offsets=np.concatenate([[0], np.cumsum(num_points2D)]))
     images = {}
-    with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for image_index in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = Image(
-                id=image_id, qvec=qvec, tvec=tvec,
-                camera_id=camera_id, name=image_name,
-                xys=xys, point3D_ids=point3D_ids)
+    ids = headers["id"].tolist()
+    camera_ids = headers["camera_id"].tolist()
+    for k, image_id in enumerate(ids):
+        images[image_id] = Image(
+            id=image_id, qvec=headers["qvec"][k].copy(), tvec=headers["tvec"][k].copy(),
+            camera_id=camera_ids[k], name=names[k],
+            xys=blocks[k]["xy"].copy(), point3D_ids=blocks[k]["point3D_id"].copy())
     return images
 
 
@@ -257,6 +302,156 @@ def read_points3d_binary(path_to_model_file):
     return points3D
 
 
+def read_num_entries_binary(path_to_model_file):
+    """ Number of cameras, images or points, the first 8 bytes of the file. """
+    with open(path_to_model_file, "rb") as fid:
+        return read_next_bytes(fid, 8, "Q")[0]
+
+
+def read_num_entries_text(path, lines_per_entry=1):
+    """
+    Number of cameras, images or points of a text file, from the
+    "# Number of ...: N" header that COLMAP writes, otherwise by counting
+    the lines that are not comments.
+    """
+    num_lines = 0
+    with open(path, "r") as fid:
+        for line in fid:
+            if line.startswith("# Number of"):
+                return int(line.split(":")[1].split(",")[0])
+            if not line.startswith("#"):
+                num_lines += 1
+    # images have a second line with the 2D points, possibly empty
+    return num_lines // lines_per_entry
+
+
+def read_model_stats(path):
+    """
+    Numbers of cameras, images and points3D of a model without reading the
+    model, from the headers of the .bin files or the .txt files.
+    """
+    stats = {}
+    for name, key, lines_per_entry in [
+        ("cameras", "num_cameras", 1),
+        ("images", "num_images", 2),
+        ("points3D", "num_points3D", 1),
+    ]:
+        bin_path = os.path.join(path, name + ".bin")
+        txt_path = os.path.join(path, name + ".txt")
+        if os.path.isfile(bin_path):
+            stats[key] = read_num_entries_binary(bin_path)
+        elif os.path.isfile(txt_path):
+            stats[key] = read_num_entries_text(txt_path, lines_per_entry)
+        else:
+            raise FileNotFoundError(f"No {name}.bin or {name}.txt in {path}")
+    return stats
+
+
+class PointColumns(collections.abc.Mapping):
+    """
+    3D points as contiguous arrays, xyz (N, 3), rgb (N, 3) uint8 and error
+    (N,), with the tracks (int32 as in the file) in CSR form: the track of point k is
+    track_image_ids[track_offsets[k]:track_offsets[k + 1]] and the same
+    slice of track_point2D_idxs.
+
+    Also a read-only {point3D_id: Point3D} mapping, so it replaces the dict
+    of read_points3d_binary. Point3D tuples are only built when accessed.
+    """
+    def __init__(self, ids, xyz, rgb, error, track_offsets, track_image_ids,
+                 track_point2D_idxs):
+        self.ids = ids
+        self.xyz = xyz
+        self.rgb = rgb
+        self.error = error
+        self.track_offsets = track_offsets
+        self.track_image_ids = track_image_ids
+        self.track_point2D_idxs = track_point2D_idxs
+        self._index = None
+
+    @property
+    def index(self):
+        """ point3D_id -> row """
+        if self._index is None:
+            self._index = {x: k for k, x in enumerate(self.ids.tolist())}
+        return self._index
+
+    def point(self, k):
+        """ Point3D of row k. """
+        start, end = self.track_offsets[k], self.track_offsets[k + 1]
+        return Point3D(id=int(self.ids[k]), xyz=self.xyz[k], rgb=self.rgb[k],
+                       error=self.error[k],
+                       image_ids=self.track_image_ids[start:end],
+                       point2D_idxs=self.track_point2D_idxs[start:end])
+
+    def __getitem__(self, point3D_id):
+        return self.point(self.index[point3D_id])
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def values(self):
+        # in row order without the id lookup
+        return (self.point(k) for k in range(len(self.ids)))
+
+
+def _gather(data, offsets, dtype, chunk_size=1 << 16):
+    """ Records of dtype starting at the byte offsets of data (uint8). """
+    out = np.empty(len(offsets), dtype=dtype)
+    steps = np.arange(dtype.itemsize)
+    for start in range(0, len(offsets), chunk_size):
+        index = offsets[start:start + chunk_size, None] + steps
+        out[start:start + chunk_size] = data[index].view(dtype)[:, 0]
+    return out
+
+
+def _walk_points3d_binary(buf):
+    """
+    Byte offsets of the records of points3D.bin. Each record starts after
+    the track of the previous one, so they are walked one at a time.
+    """
+    num_points = struct.unpack_from("<Q", buf, 0)[0]
+    offsets = np.empty(num_points, dtype=np.int64)
+    length_offset = POINT3D_HEADER_DTYPE.fields["track_length"][1]
+    unpack_from = struct.Struct("<Q").unpack_from
+    offset = 8
+    for k in range(num_points):
+        offsets[k] = offset
+        offset += POINT3D_HEADER_DTYPE.itemsize + TRACK_ELEM_DTYPE.itemsize * \
+            unpack_from(buf, offset + length_offset)[0]
+    return offsets
+
+
+def read_points3d_binary_columnar(path_to_model_file):
+    """
+    points3D.bin as a PointColumns. The file is memory-mapped, the only
+    loop over the points in Python finds where each record starts, the
+    fields and tracks are gathered with numpy.
+    """
+    with open(path_to_model_file, "rb") as fid, \
+            mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offsets = _walk_points3d_binary(buf)
+        data = np.frombuffer(buf, dtype=np.uint8)
+        headers = _gather(data, offsets, POINT3D_HEADER_DTYPE)
+        track_lengths = headers["track_length"].astype(np.int64)
+        track_offsets = np.concatenate([[0], np.cumsum(track_lengths)])
+        # byte offset of every track element
+        starts = offsets + POINT3D_HEADER_DTYPE.itemsize
+        elem_offsets = np.repeat(starts - TRACK_ELEM_DTYPE.itemsize * track_offsets[:-1],
+                                 track_lengths)
+        elem_offsets += TRACK_ELEM_DTYPE.itemsize * np.arange(len(elem_offsets))
+        tracks = _gather(data, elem_offsets, TRACK_ELEM_DTYPE)
+        del data
+    return PointColumns(
+        ids=headers["id"].astype(np.int64), xyz=headers["xyz"].copy(),
+        rgb=headers["rgb"].copy(), error=headers["error"].copy(),
+        track_offsets=track_offsets,
+        track_image_ids=tracks["image_id"].copy(),
+        track_point2D_idxs=tracks["point2D_idx"].copy())
+
+
 def read_model(path, ext):
     if ext == ".txt":
         cameras = read_cameras_text(os.path.join(path, "cameras" + ext))
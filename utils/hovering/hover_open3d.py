@@ -72,8 +72,8 @@ class HoverRunner:
         if pcd_path is not None:
             pcd = o3d.io.read_point_cloud(args.pcd_path)
         else:
-            pcd_np = np.asarray([v.xyz for v in model.points.values()])
-            pcd_rgb = np.asarray([v.rgb / 255 for v in model.points.values()])
+            pcd_np = model.points.xyz
+            pcd_rgb = model.points.rgb / 255
             pcd = o3d.geometry.PointCloud()
             pcd.points = o3d.utility.Vector3dVector(pcd_np)
             pcd.colors = o3d.utility.Vector3dVector(pcd_rgb)
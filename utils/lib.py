@@ -1,13 +1,30 @@
-import pycolmap
 import shutil
 import os
 import glob
-import subprocess
+import contextlib
+
+from utils.colmap_utils import read_model_stats
 
 def get_num_images(model_path):
-    reconstruction = pycolmap.Reconstruction(model_path)
-    num_images = reconstruction.num_images()
-    return num_images
+    return read_model_stats(model_path)['num_images']
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', opener=open):
+    """
+    Opens a temporary file next to path and renames it to path once it is
+    written, so that other processes never read a partial file and a file
+    that exists is complete.
+
+    :param opener: e.g. gzip.open for a compressed file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with opener(tmp_path, mode) as fp:
+            yield fp
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def read_lines_from_file(filename):
     """
@@ -41,9 +58,3 @@ def keep_model_with_largest_images(reconstuction_path):
                 shutil.rmtree(model)   
         os.rename(selected_model,os.path.join(reconstuction_path,'0'))
     return max_images
-
-    # Define the function to execute in each process
-def run_script(script_path, arg):
-    cmd = ['python3', script_path] + arg
-    print(cmd)
-    subprocess.call(cmd)
\ No newline at end of file
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.lib import atomic_write
+
+
+def manifest_path(root, depth):
+    # in the user cache, a file inside root would change the mtime of root
+    key = hashlib.sha1(json.dumps([os.path.abspath(root), depth]).encode()).hexdigest()
+    cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'epic_fields', 'manifest')
+    return os.path.join(cache_dir, key + '.json.gz')
+
+
+class Manifest:
+    """
+    Frames of the videos under a dataset root, scanned once and kept in a
+    gzipped JSON file so that the stages do not list the frame directories
+    again. Only the frame directories of the videos asked for are scanned.
+
+    depth: levels of directories above the frames, 2 for EPIC-KITCHENS
+        (<root>/<Pxx>/<video>/frame_*.jpg), 1 for <root>/<video>/*.jpg
+
+    videos: videos whose frame directories are scanned up front, all of
+        them if None; the frames of the others are scanned on first use
+
+    Every directory is stored with its mtime. Adding, removing or renaming
+    an entry changes the mtime of its directory, so on refresh unchanged
+    directories cost one stat and only changed ones are listed again. Stats
+    and listings run in a pool of threads, which hides the latency of
+    network file systems.
+    """
+    def __init__(self, root, depth=2, path=None, num_workers=16, videos=None):
+        self.root = root
+        self.depth = depth
+        self.path = path or manifest_path(root, depth)
+        self.num_workers = num_workers
+        self.dirs = self.load()
+        self.refresh(videos)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with gzip.open(self.path, 'rt') as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('root') != os.path.abspath(self.root) or manifest.get('depth') != self.depth:
+            return {}
+        return manifest['dirs']
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        manifest = {'root': os.path.abspath(self.root), 'depth': self.depth, 'dirs': self.dirs}
+        with atomic_write(self.path, 'wt', opener=gzip.open) as fp:
+            json.dump(manifest, fp, separators=(',', ':'))
+
+    def scan(self, rel_dir, leaf):
+        """ Entry of a directory, listed again only if its mtime changed. """
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        entry = self.dirs.get(rel_dir)
+        if entry is not None and entry['mtime_ns'] == mtime_ns and ('frames' in entry) == leaf:
+            return entry
+        if not leaf:
+            children = sorted(x.name for x in os.scandir(path) if x.is_dir())
+            return {'mtime_ns': mtime_ns, 'children': children}
+        frames = sorted(
+            (x.name, x.stat().st_size) for x in os.scandir(path)
+            if x.name.endswith('.jpg')
+        )
+        return {
+            'mtime_ns': mtime_ns,
+            'frames': [name for name, _ in frames],
+            'sizes': [size for _, size in frames],
+        }
+
+    def refresh(self, videos=None):
+        """
+        Rescans the changed directories above the videos and the changed
+        frame directories of videos, all of them if None, saves the manifest
+        if any changed. The frame directories of other videos are checked
+        when first asked for, see entry.
+        """
+        dirs = {}
+        level = ['']
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            for _ in range(self.depth):
+                entries = pool.map(lambda x: self.scan(x, False), level)
+                next_level = []
+                for rel_dir, entry in zip(level, entries):
+                    if entry is None:
+                        continue
+                    dirs[rel_dir] = entry
+                    next_level += [os.path.join(rel_dir, x) for x in entry['children']]
+                level = next_level
+            self.videos = {os.path.basename(rel_dir): rel_dir for rel_dir in level}
+            if videos is not None:
+                level = [self.videos[x] for x in videos if x in self.videos]
+            entries = pool.map(lambda x: self.scan(x, True), level)
+            for rel_dir, entry in zip(level, entries):
+                if entry is None:
+                    del self.videos[os.path.basename(rel_dir)]
+                else:
+                    dirs[rel_dir] = entry
+        self.checked = set(level)
+        # frames of the videos not checked yet as loaded
+        for rel_dir in self.videos.values():
+            entry = self.dirs.get(rel_dir)
+            if rel_dir not in dirs and entry is not None and 'frames' in entry:
+                dirs[rel_dir] = entry
+        changed = dirs != self.dirs
+        self.dirs = dirs
+        if changed:
+            self.save()
+
+    def entry(self, video):
+        """ Frames and sizes of a video, checked on first use. """
+        rel_dir = self.videos[video]
+        if rel_dir not in self.checked:
+            entry = self.scan(rel_dir, True)
+            if entry is None:
+                del self.videos[video]
+                raise KeyError(video)
+            self.checked.add(rel_dir)
+            if entry != self.dirs.get(rel_dir):
+                self.dirs[rel_dir] = entry
+                self.save()
+        return self.dirs[rel_dir]
+
+    def folder(self, video):
+        return os.path.join(self.root, self.videos[video])
+
+    def frame_names(self, video):
+        return self.entry(video)['frames']
+
+    def frames(self, video):
+        """ Sorted paths of the frames of a video. """
+        folder = self.folder(video)
+        return [os.path.join(folder, x) for x in self.frame_names(video)]
+
+    def num_frames(self, video):
+        return len(self.frame_names(video))
+
+    def num_bytes(self, video):
+        return sum(self.entry(video)['sizes'])
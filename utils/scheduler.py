@@ -0,0 +1,167 @@
+import contextlib
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def colmap_binary():
+    # e.g. COLMAP=$PWD/benchmarks/colmap_stub.py to run the scheduler without COLMAP
+    return os.environ.get('COLMAP', 'colmap')
+
+
+def add_scheduler_args(parser):
+    parser.epilog = ('The COLMAP environment variable replaces the colmap executable, '
+                     'benchmarks/colmap_stub.py runs the phases without COLMAP.')
+    parser.add_argument('--gpu_indices', type=int, nargs='+', default=None,
+                        help='Indices of the GPUs to use, overrides --gpu_index.')
+    parser.add_argument('--gpu_slots', type=int, default=1,
+                        help='Feature extraction and matching phases to run at once on each GPU.')
+    parser.add_argument('--cpu_slots', type=int, default=1,
+                        help='Mapper / registrator phases to run at once, each gets the CPUs '
+                             'divided by this number.')
+    parser.add_argument('--max_concurrent', type=int, default=None,
+                        help='Videos in progress at once, by default the number of slots.')
+    parser.add_argument('--vocab_tree_path', type=str,
+                        default='vocab_bins/vocab_tree_flickr100K_words32K.bin')
+
+
+class Slots:
+    """
+    A fixed set of slots (CPU slots, or GPU indices for GPU slots).
+    Waiting jobs get a free slot in the order of their priority, lowest
+    first, and in the order they asked within the same priority.
+    """
+    def __init__(self, ids):
+        self.free = list(ids)
+        self.waiting = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def acquire(self, priority=0):
+        with self.cond:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+            while not (self.free and self.waiting[0] == ticket):
+                self.cond.wait()
+            heapq.heappop(self.waiting)
+            slot = self.free.pop(0)
+            self.cond.notify_all()
+        try:
+            yield slot
+        finally:
+            with self.cond:
+                self.free.append(slot)
+                self.cond.notify_all()
+
+
+class Phase:
+    """
+    One command of a job, run while holding a slot of `resource` ('cpu' or
+    'gpu'). command(slot) returns the arguments, slot is the GPU index for
+    GPU phases. stdout goes to the job log unless stdout_path is given.
+    """
+    def __init__(self, name, resource, command, stdout_path=None):
+        self.name = name
+        self.resource = resource
+        self.command = command
+        self.stdout_path = stdout_path
+
+
+class Job:
+    """
+    The phases of one video, run in order in the working directory of the
+    video. Jobs with a higher cost get slots first.
+    """
+    def __init__(self, video, workdir, phases, cost, log_path, setup=None, finish=None):
+        self.video = video
+        self.workdir = workdir
+        self.phases = phases
+        self.cost = cost
+        self.log_path = log_path
+        self.setup = setup
+        self.finish = finish
+
+    def run(self, slots):
+        """ Returns a dict with the runtime per phase and the error, if any. """
+        result = {'video': self.video, 'cost': self.cost, 'times': {}, 'error': None}
+        t0 = time.perf_counter()
+        os.makedirs(self.workdir, exist_ok=True)
+        with open(self.log_path, 'w') as log_fp:
+            try:
+                if self.setup is not None:
+                    self.setup()
+                for phase in self.phases:
+                    with slots[phase.resource].acquire(priority=-self.cost) as slot:
+                        t = time.perf_counter()
+                        command = phase.command(slot)
+                        log_fp.write(' '.join(command) + '\n')
+                        log_fp.flush()
+                        stdout = contextlib.nullcontext(log_fp)
+                        if phase.stdout_path is not None:
+                            stdout = open(phase.stdout_path, 'w')
+                        with stdout as stdout_fp:
+                            returncode = subprocess.call(
+                                command, cwd=self.workdir, stdout=stdout_fp, stderr=log_fp
+                            )
+                        result['times'][phase.name] = time.perf_counter() - t
+                    if returncode != 0:
+                        raise RuntimeError(f'{phase.name} exited with {returncode}')
+                if self.finish is not None:
+                    result['finish'] = self.finish()
+            except Exception as e:
+                result['error'] = str(e)
+                log_fp.write(traceback.format_exc())
+        result['runtime'] = time.perf_counter() - t0
+        return result
+
+
+def make_slots(cpu_slots=1, gpu_indices=(0,), gpu_slots=1):
+    return {
+        'cpu': Slots(range(cpu_slots)),
+        'gpu': Slots([x for x in gpu_indices for _ in range(gpu_slots)]),
+    }
+
+
+class Scheduler:
+    """
+    Runs jobs submitted at any time in a pool of max_concurrent threads.
+    Schedulers sharing the same slots (e.g. of two pipeline stages) never
+    run more phases at once than there are slots.
+    """
+    def __init__(self, slots, max_concurrent=None):
+        self.slots = slots
+        if max_concurrent is None:
+            max_concurrent = sum(len(x.free) for x in slots.values())
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_concurrent))
+
+    def submit(self, job):
+        """ Returns a future of the result of job.run. """
+        return self.pool.submit(job.run, self.slots)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def run_jobs(jobs, cpu_slots=1, gpu_indices=(0,), gpu_slots=1, max_concurrent=None,
+             callback=None):
+    """
+    Runs the jobs concurrently, most expensive first. At most cpu_slots CPU
+    phases and gpu_slots GPU phases per GPU run at the same time, so one
+    video's mapper runs while another one extracts and matches features.
+    callback(result) is called as each job finishes. Returns the results.
+    """
+    scheduler = Scheduler(make_slots(cpu_slots, gpu_indices, gpu_slots), max_concurrent)
+    futures = [scheduler.submit(job) for job in sorted(jobs, key=lambda job: -job.cost)]
+    results = []
+    for future in as_completed(futures):
+        results.append(future.result())
+        if callback is not None:
+            callback(results[-1])
+    scheduler.shutdown()
+    return results